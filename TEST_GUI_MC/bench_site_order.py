@@ -0,0 +1,52 @@
+# Benchmark for site_order.py: stage travel time of each ordering, and how long planning takes,
+# for grids from 100 to 10,000 sites. Times use the default model (mcu_side.STEP_DELAY, one axis at a time).
+#
+# Two site lists per size:
+#   "grid"     - a full square grid, listed in a random order (e.g. exported from a layout tool)
+#   "wafer"    - the grid sites that fit on a round wafer, also shuffled
+#
+# Run from this folder:  python bench_site_order.py
+
+import time
+import numpy as np
+import site_order
+
+SITE_COUNTS = [100, 1_000, 10_000]
+PITCH = 2000  # Steps between sites
+EXPOSURE = 10.0  # Seconds per site, only used for the job estimate
+
+def make_sites(count, shape, rng):
+    side = int(round(count ** 0.5))
+    if shape == "wafer":
+        side = int(round((count * 4 / np.pi) ** 0.5))  # Roughly `count` sites fit in the circle
+    sites = []
+    centre = (side - 1) / 2
+    for row in range(side):
+        for column in range(side):
+            if shape == "wafer" and (column - centre) ** 2 + (row - centre) ** 2 > (side / 2) ** 2:
+                continue
+            sites.append({"x": column * PITCH, "y": row * PITCH, "exposure": EXPOSURE})
+    rng.shuffle(sites)
+    return sites
+
+def main():
+    rng = np.random.default_rng(0)
+    model = site_order.StageTimeModel()
+    print(f"Step delay {model.step_delay_x * 1000:.2f} ms, pitch {PITCH} steps, {EXPOSURE:.0f} s exposure per site")
+    print(f"{'sites':>6s} {'layout':6s} {'ordering':10s} {'travel':>10s} {'vs listed':>9s} {'job':>9s} {'planning':>9s}")
+    for count in SITE_COUNTS:
+        for shape in ("grid", "wafer"):
+            sites = make_sites(count, shape, rng)
+            listed = None
+            for ordering in site_order.ORDERINGS:
+                start = time.perf_counter()
+                ordered = site_order.plan(sites, ordering, model=model)
+                planning = time.perf_counter() - start
+                estimate = site_order.estimate_duration(ordered, model=model)
+                if listed is None:
+                    listed = estimate["move"]
+                print(f"{len(sites):6d} {shape:6s} {ordering:10s} {site_order.format_duration(estimate['move']):>10s}"
+                      f" {estimate['move'] / listed * 100:8.1f}% {site_order.format_duration(estimate['total']):>9s} {planning:8.2f}s")
+
+if __name__ == "__main__":
+    main()
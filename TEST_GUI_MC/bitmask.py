@@ -0,0 +1,100 @@
+# Compact 1-bit-per-pixel mask for black/white lithography patterns.
+#
+# A mask held as an RGB uint8 array uses 24 bits per pixel, even though every pixel is
+# just "UV on" or "UV off". BitMask stores the same thing with np.packbits (8 pixels per byte,
+# most significant bit first, each row padded to a whole byte - the same layout as a
+# PIL mode "1" image), and expands straight into one plane of an output frame when needed.
+
+from functools import lru_cache
+import numpy as np
+from PIL import Image
+
+EXPAND_ROWS = 256  # Rows expanded per chunk, keeps the temporary small for huge masks
+
+
+@lru_cache(maxsize=64)
+def _expand_table(on, off):
+    # For every possible packed byte, the 8 output pixel values it stands for
+    bits = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1)
+    table = np.where(bits, np.uint8(on), np.uint8(off)).astype(np.uint8)
+    table.flags.writeable = False
+    return table
+
+
+def pack_if_binary(arr):
+    """BitMask of an RGB (or 2D) uint8 array if it is pure black/white, otherwise None"""
+    plane = arr if arr.ndim == 2 else arr[..., 0]
+    if arr.ndim == 3 and any(not np.array_equal(plane, arr[..., c]) for c in range(1, arr.shape[2])):
+        return None  # Coloured, the channels carry different information
+    if np.any((plane != 0) & (plane != 255)):
+        return None  # Greyscale
+    return BitMask.from_array(plane)
+
+
+class BitMask:
+    """Binary mask packed 8 pixels per byte"""
+
+    def __init__(self, packed, width):
+        if packed.dtype != np.uint8 or packed.ndim != 2 or packed.shape[1] != (width + 7) // 8:
+            raise ValueError(f"Packed mask of shape {packed.shape} doesn't match a width of {width} px")
+        self.packed = packed  # (height, ceil(width / 8)) uint8
+        self.width = width
+        self.height = packed.shape[0]
+
+    @classmethod
+    def from_array(cls, arr, threshold=128):
+        """Pack a 2D array; pixels >= threshold are on (for bool arrays, True is on)"""
+        if arr.ndim != 2:
+            raise ValueError(f"Expected a 2D array, got shape {arr.shape}")
+        bits = arr if arr.dtype == bool else arr >= threshold
+        return cls(np.packbits(bits, axis=1), arr.shape[1])
+
+    @classmethod
+    def from_image(cls, img, threshold=128):
+        """Pack a PIL image (any mode). Uses the luminance for colour images."""
+        if img.mode != "1":
+            img = img.convert("L").point(lambda v: 255 if v >= threshold else 0, mode="1")
+        packed = np.frombuffer(img.tobytes(), dtype=np.uint8).reshape(img.height, (img.width + 7) // 8)
+        return cls(packed.copy(), img.width)
+
+    @property
+    def shape(self):
+        return (self.height, self.width)
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes
+
+    def count(self):
+        """Number of pixels that are on"""
+        return int(np.unpackbits(self.packed, axis=1, count=self.width).sum(dtype=np.int64))
+
+    def expand_into(self, out, on=255, off=0):
+        """Write the mask into a 2D uint8 array (or a view like frame[..., 2]) as on/off values"""
+        if out.shape != self.shape:
+            raise ValueError(f"Output of shape {out.shape} doesn't match mask shape {self.shape}")
+        table = _expand_table(int(on), int(off))
+        for row in range(0, self.height, EXPAND_ROWS):
+            chunk = self.packed[row:row + EXPAND_ROWS]
+            pixels = table[chunk].reshape(chunk.shape[0], -1)  # (rows, bytes * 8)
+            out[row:row + EXPAND_ROWS] = pixels[:, :self.width]
+        return out
+
+    def to_array(self, on=255, off=0):
+        """Expand to a new (height, width) uint8 array"""
+        return self.expand_into(np.empty(self.shape, dtype=np.uint8), on, off)
+
+    def invert(self):
+        """New mask with every pixel flipped (padding bits stay 0)"""
+        inverted = np.invert(self.packed)
+        spare = self.packed.shape[1] * 8 - self.width
+        if spare:
+            inverted[:, -1] &= np.uint8((0xFF << spare) & 0xFF)
+        return BitMask(inverted, self.width)
+
+    def to_image(self):
+        """PIL mode "1" image (same bit layout, so this is just a copy of the bytes)"""
+        return Image.frombytes("1", (self.width, self.height), self.packed.tobytes())
+
+    def __eq__(self, other):
+        return isinstance(other, BitMask) and self.width == other.width and np.array_equal(self.packed, other.packed)
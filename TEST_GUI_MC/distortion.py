@@ -0,0 +1,180 @@
+# Pre-warp for the DLP projection optics, so the pattern lands on the wafer undistorted.
+#
+# The projection optics add keystone (the DLP isn't perfectly square to the wafer) and barrel
+# or pincushion distortion (the lens). Both are described by a small JSON calibration file
+# (config.DISTORTION_CALIBRATION) that says, for every DLP pixel, where it lands in the
+# intended pattern:
+#   {
+#     "homography": [[1, 0, 0], [0, 1, 0], [0, 0, 1]],  keystone, a 3x3 projective transform
+#     "k1": 0.0, "k2": 0.0,                             radial distortion, r' = r (1 + k1 r^2 + k2 r^4)
+#     "center": [0.0, 0.0]                              centre of the radial distortion
+#   }
+# in normalised coordinates: (0, 0) is the middle of the frame and 1 is half the longer side,
+# so one calibration works at every resolution. Missing entries mean "no distortion".
+#
+# Each output (DLP) pixel then simply takes the composited frame's pixel at that position:
+#   corrected[y, x] = frame[map_y[y, x], map_x[y, x]]      (black where it falls off the frame)
+# The maps are built once per (calibration file contents, resolution) with numpy, saved in
+# config.DISTORTION_CACHE_FOLDER, and applied to every frame with a single cv2.remap (or a
+# numpy gather without OpenCV, nearest neighbour only). "nearest" keeps black/white masks
+# black/white; "linear" is smoother for greyscale.
+
+import hashlib
+import os
+import json
+import threading
+from functools import lru_cache
+import numpy as np
+import config
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None  # Falls back to a numpy gather (nearest neighbour)
+
+INTERPOLATIONS = ("nearest", "linear")
+MAX_REMAPS = 4  # Prepared remaps kept in memory (one per calibration/resolution in use)
+
+# Counters
+builds = 0
+disk_hits = 0
+
+_remaps = {}
+_lock = threading.Lock()
+_warned_linear = False
+
+
+@lru_cache(maxsize=16)
+def _file_sha256(abs_path, mtime_ns, file_size):
+    # mtime and size are only in the arguments so an edited file is hashed again
+    with open(abs_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def calibration_sha256(path):
+    stat = os.stat(path)
+    return _file_sha256(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def load_calibration(path):
+    with open(path) as f:
+        calibration = json.load(f)
+    return {
+        "homography": np.array(calibration.get("homography", np.eye(3)), dtype=np.float64).reshape(3, 3),
+        "k1": float(calibration.get("k1", 0.0)),
+        "k2": float(calibration.get("k2", 0.0)),
+        "center": np.array(calibration.get("center", [0.0, 0.0]), dtype=np.float64).reshape(2),
+    }
+
+
+def build_maps(calibration, size):
+    """(map_x, map_y) float32 arrays of shape (height, width): the source position of each output pixel"""
+    width, height = size
+    scale = max(width, height) / 2
+    # Pixel centres, normalised
+    x = ((np.arange(width, dtype=np.float64) + 0.5 - width / 2) / scale)[None, :]
+    y = ((np.arange(height, dtype=np.float64) + 0.5 - height / 2) / scale)[:, None]
+    h = calibration["homography"]
+    w = h[2, 0] * x + h[2, 1] * y + h[2, 2]
+    u = (h[0, 0] * x + h[0, 1] * y + h[0, 2]) / w
+    v = (h[1, 0] * x + h[1, 1] * y + h[1, 2]) / w
+    cx, cy = calibration["center"]
+    u -= cx
+    v -= cy
+    r2 = u * u + v * v
+    factor = 1 + calibration["k1"] * r2 + calibration["k2"] * r2 * r2
+    map_x = ((u * factor + cx) * scale + width / 2 - 0.5).astype(np.float32)
+    map_y = ((v * factor + cy) * scale + height / 2 - 0.5).astype(np.float32)
+    return map_x, map_y
+
+
+def cache_path(calibration_path, size):
+    sha = calibration_sha256(calibration_path)
+    return os.path.join(config.DISTORTION_CACHE_FOLDER, f"{sha[:32]}_{size[0]}x{size[1]}.npy")
+
+
+def load_maps(calibration_path, size):
+    """Maps for this calibration and size, from the disk cache if they were built before"""
+    global builds, disk_hits
+    size = tuple(size)
+    path = cache_path(calibration_path, size)
+    if os.path.exists(path):
+        try:
+            maps = np.load(path)
+            if maps.shape == (2, size[1], size[0]) and maps.dtype == np.float32:
+                disk_hits += 1
+                return maps[0], maps[1]
+        except Exception as e:
+            print(f"Ignoring unreadable distortion map {path}: {e}")
+
+    map_x, map_y = build_maps(load_calibration(calibration_path), size)
+    builds += 1
+    try:
+        os.makedirs(config.DISTORTION_CACHE_FOLDER, exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            np.save(f, np.stack((map_x, map_y)))
+        os.replace(temp_path, path)
+    except Exception as e:
+        print(f"Could not cache distortion map {path}: {e}")
+    return map_x, map_y
+
+
+class Remap:
+    """Maps prepared for fast repeated use on frames of one size"""
+
+    def __init__(self, map_x, map_y, interpolation="nearest"):
+        global _warned_linear
+        if interpolation not in INTERPOLATIONS:
+            raise ValueError(f"Unknown interpolation {interpolation}, expected one of {INTERPOLATIONS}")
+        self.size = (map_x.shape[1], map_x.shape[0])
+        self.index = None  # numpy fallback only
+        if cv2 is not None:
+            # Fixed-point maps are what cv2.remap uses internally; converting once saves it per frame
+            self.interpolation = cv2.INTER_NEAREST if interpolation == "nearest" else cv2.INTER_LINEAR
+            self.map1, self.map2 = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2, nninterpolation=interpolation == "nearest")
+            return
+        if interpolation == "linear" and not _warned_linear:
+            print("OpenCV not installed, distortion correction uses nearest neighbour instead of linear.")
+            _warned_linear = True
+        width, height = self.size
+        ix = np.rint(map_x).astype(np.int32)  # Rounds halves to even, like OpenCV
+        iy = np.rint(map_y).astype(np.int32)
+        outside = (ix < 0) | (ix >= width) | (iy < 0) | (iy >= height)
+        self.index = np.where(outside, 0, iy * width + ix).ravel()
+        self.outside = np.flatnonzero(outside)  # Output pixels that stay black
+
+    def apply(self, frame, out=None):
+        """Corrected copy of a (height, width, channels) uint8 frame"""
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            raise ValueError(f"Frame of shape {frame.shape} doesn't match distortion maps for {self.size}")
+        if self.index is None:
+            return cv2.remap(frame, self.map1, self.map2, self.interpolation, dst=out,
+                             borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        if out is None:
+            out = np.empty_like(frame)
+        flat_out = out.reshape(len(self.index), -1)
+        np.take(frame.reshape(len(self.index), -1), self.index, axis=0, out=flat_out)
+        flat_out[self.outside] = 0
+        return out
+
+
+def get_remap(calibration_path, size, interpolation=None):
+    if interpolation is None:
+        interpolation = config.DISTORTION_INTERPOLATION
+    key = (calibration_sha256(calibration_path), tuple(size), interpolation)
+    with _lock:  # Frames are composited on worker threads too; only build the maps once
+        remap = _remaps.get(key)
+        if remap is None:
+            remap = Remap(*load_maps(calibration_path, size), interpolation)
+            if len(_remaps) >= MAX_REMAPS:
+                _remaps.pop(next(iter(_remaps)))
+            _remaps[key] = remap
+    return remap
+
+
+def correct(frame):
+    """Pre-warp a composited frame with config.DISTORTION_CALIBRATION (unchanged if none is set)"""
+    if not config.DISTORTION_CALIBRATION:
+        return frame
+    return get_remap(config.DISTORTION_CALIBRATION, (frame.shape[1], frame.shape[0])).apply(frame)
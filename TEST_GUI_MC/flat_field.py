@@ -0,0 +1,181 @@
+# Flat-field compensation: evens out the UV intensity across the projected field.
+#
+# The UV LED and optics don't light the field evenly, so a uniform pattern gives some areas
+# more dose than others. A gain map (config.FLAT_FIELD_MAP) holds one factor per pixel,
+# stored as uint8 (gain = value / 255): the dimmest part of the field gets 255 and brighter
+# parts are turned down to match it. Loading resizes it to the lithography size once; the
+# blue (UV) plane is then multiplied by it when the plane is built in
+# image_processing.layer_plane, in strips of STRIP_ROWS rows so there is never a full-frame
+# temporary. Planes are cached, so this only happens when the photo or UV brightness changes.
+#
+# Building the map (from camera captures of a uniform white projection, cropped to the field):
+#   python flat_field.py captures/*.png -o flat_field.npy
+#   python flat_field.py captures --dark dark.png --crop 100 80 1600 900 --blur 25 --size 3840 2160
+# The captures are averaged, the dark frame subtracted and the result smoothed; the gain is then
+# (dimmest intensity) / (intensity), with "dimmest" taken at a low percentile so a few dead or
+# dusty pixels don't turn the whole field down.
+
+import argparse
+import os
+from functools import lru_cache
+import numpy as np
+from PIL import Image
+import config
+
+STRIP_ROWS = 256  # Rows multiplied at a time
+IMAGE_EXTENSIONS = (".png", ".bmp", ".jpg", ".jpeg", ".tif", ".tiff")
+REFERENCE_PERCENTILE = 1.0  # Intensity percentile the rest of the field is turned down to
+
+
+@lru_cache(maxsize=4)
+def _load_gain(abs_path, mtime_ns, size):
+    # mtime is only in the arguments so an edited map is loaded again
+    if abs_path.lower().endswith(".npy"):
+        gain = np.load(abs_path)
+    else:
+        gain = np.asarray(Image.open(abs_path).convert("L"))
+    if gain.dtype != np.uint8 or gain.ndim != 2:
+        raise ValueError(f"{abs_path}: expected a 2D uint8 gain map, got {gain.dtype} {gain.shape}")
+    if (gain.shape[1], gain.shape[0]) != size:
+        gain = np.asarray(Image.fromarray(gain).resize(size, Image.BILINEAR))
+    gain = np.ascontiguousarray(gain)
+    gain.flags.writeable = False
+    return gain
+
+
+def load_gain(path, size):
+    """The gain map at size = (width, height), as read-only uint8 (255 = full intensity)"""
+    return _load_gain(os.path.abspath(path), os.stat(path).st_mtime_ns, tuple(size))
+
+
+def gain_key():
+    # Part of the plane and frame cache keys, None when compensation is off
+    if not config.FLAT_FIELD_MAP:
+        return None
+    return (os.path.abspath(config.FLAT_FIELD_MAP), os.stat(config.FLAT_FIELD_MAP).st_mtime_ns)
+
+
+def apply_gain(plane, gain):
+    """plane = round(plane * gain / 255), in place, a strip at a time"""
+    if plane.shape != gain.shape:
+        raise ValueError(f"Plane of shape {plane.shape} doesn't match gain map {gain.shape}")
+    strip = np.empty((min(STRIP_ROWS, plane.shape[0]), plane.shape[1]), dtype=np.uint16)
+    for row in range(0, plane.shape[0], STRIP_ROWS):
+        rows = slice(row, row + STRIP_ROWS)
+        product = strip[:plane[rows].shape[0]]
+        np.multiply(plane[rows], gain[rows], out=product, dtype=np.uint16)  # At most 255 * 255, fits
+        product += 127
+        product //= 255
+        plane[rows] = product
+    return plane
+
+
+def compensate(plane):
+    """Apply config.FLAT_FIELD_MAP to a UV plane in place (unchanged if no map is set)"""
+    if not config.FLAT_FIELD_MAP:
+        return plane
+    return apply_gain(plane, load_gain(config.FLAT_FIELD_MAP, (plane.shape[1], plane.shape[0])))
+
+
+def find_images(paths):
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            images.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                          if name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            images.append(path)
+    return images
+
+
+def box_blur(arr, width, axis):
+    """Mean over `width` neighbours along one axis (edges repeated), with a cumulative sum"""
+    before = width // 2
+    padded = np.pad(arr, [(before, width - 1 - before) if a == axis else (0, 0) for a in range(arr.ndim)], mode="edge")
+    sums = np.cumsum(padded, axis=axis, dtype=np.float64)
+    sums = np.insert(sums, 0, 0, axis=axis)
+    upper = np.take(sums, np.arange(width, sums.shape[axis]), axis=axis)
+    lower = np.take(sums, np.arange(0, sums.shape[axis] - width), axis=axis)
+    return ((upper - lower) / width).astype(np.float32)
+
+
+def gaussian_blur(arr, sigma):
+    # Three box blurs in a row are very close to a Gaussian (PIL can't blur float images)
+    width = max(1, int(round(np.sqrt(4 * sigma * sigma + 1))))
+    for _ in range(3):
+        for axis in (0, 1):
+            arr = box_blur(arr, width, axis)
+    return arr
+
+
+def load_capture(path, crop=None):
+    img = Image.open(path).convert("L")
+    if crop is not None:
+        x, y, width, height = crop
+        img = img.crop((x, y, x + width, y + height))
+    return np.asarray(img, dtype=np.float32)
+
+
+def build_gain(captures, dark=None, blur=15, size=None, crop=None):
+    """Gain map (uint8) from captures of a uniform projection; returns (gain, stats)"""
+    total = None
+    for path in captures:
+        capture = load_capture(path, crop)
+        if total is None:
+            total = np.zeros_like(capture)
+        elif capture.shape != total.shape:
+            raise ValueError(f"{path} is {capture.shape[1]}x{capture.shape[0]}, the other captures are {total.shape[1]}x{total.shape[0]}")
+        total += capture
+    if total is None:
+        raise ValueError("No captures given")
+    intensity = total / len(captures)
+    if dark is not None:
+        intensity = np.maximum(intensity - load_capture(dark, crop), 0)
+    # Smooth out camera noise and speckle
+    if blur:
+        intensity = gaussian_blur(intensity, blur)
+    image = Image.fromarray(intensity.astype(np.float32))  # Mode "F", keeps the averaged values as floats
+    if size is not None:
+        image = image.resize(size, Image.BILINEAR)
+    intensity = np.asarray(image, dtype=np.float32)
+
+    reference = np.percentile(intensity, REFERENCE_PERCENTILE)
+    if reference <= 0:
+        raise ValueError("The dimmest part of the captures is black; is the projection in the crop?")
+    gain = np.clip(reference / np.maximum(intensity, 1e-6), 0, 1)
+    gain_u8 = np.round(gain * 255).astype(np.uint8)
+    evened = intensity * gain_u8 / 255
+    stats = {
+        "captures": len(captures),
+        "uniformity_before": float(intensity.max() / reference),
+        "uniformity_after": float(evened.max() / max(np.percentile(evened, REFERENCE_PERCENTILE), 1e-6)),
+        "mean_gain": float(gain_u8.mean() / 255),
+    }
+    return gain_u8, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a flat-field gain map from captures of a uniform UV projection.")
+    parser.add_argument("paths", nargs="+", help="captures, or folders of them")
+    parser.add_argument("-o", "--output", default="flat_field.npy", help="gain map to write (.npy, or .png)")
+    parser.add_argument("--dark", help="capture with the projector dark, subtracted from the others")
+    parser.add_argument("--crop", type=int, nargs=4, metavar=("X", "Y", "WIDTH", "HEIGHT"),
+                        help="the projected field in the captures")
+    parser.add_argument("--blur", type=float, default=15, help="Gaussian blur sigma in capture pixels (0 = none)")
+    parser.add_argument("--size", type=int, nargs=2, metavar=("WIDTH", "HEIGHT"),
+                        default=(config.LITHO_SIZE_PX_X, config.LITHO_SIZE_PX_Y), help="size of the map")
+    args = parser.parse_args()
+
+    captures = find_images(args.paths)
+    gain, stats = build_gain(captures, args.dark, args.blur, tuple(args.size), args.crop)
+    if args.output.lower().endswith(".npy"):
+        np.save(args.output, gain)
+    else:
+        Image.fromarray(gain, "L").save(args.output)
+    print(f"Wrote {args.output} ({gain.shape[1]}x{gain.shape[0]}) from {stats['captures']} captures")
+    print(f"Brightest/dimmest: {stats['uniformity_before']:.3f} before, {stats['uniformity_after']:.3f} after "
+          f"(UV intensity down to {stats['mean_gain'] * 100:.1f}% on average)")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,45 +12,245 @@
 # Anti-aliasing may be helpful, and should be experimented with
 # to see if it offers better results, specifically for curves.
 
+import os
+from functools import lru_cache
 import numpy as np
 import config
 from PIL import Image
 from PyQt5.QtWidgets import QGraphicsPixmapItem
 from PyQt5.QtGui import QPixmap, QImage
+from byte_cache import ByteLRUCache
+from bitmask import BitMask, pack_if_binary
+from snapshot_writer import SnapshotWriter
+import svg_raster
+import distortion
+import flat_field
 
-def add_images(img_photo_path, img_align_path):
-    
-    img_photo = Image.open(img_photo_path).convert("RGB")
-    img_align = Image.open(img_align_path).convert("RGB")
+# Decoded and resized layers, kept between preview updates.
+# A brightness change then only has to redo the channel math below.
+# Check layer_cache.stats() for hit/miss counters.
+layer_cache = ByteLRUCache(config.LAYER_CACHE_MB * 1024 * 1024)
+
+# Per-layer output planes (one 2D array per LED channel), see layer_plane().
+# Changing UV only recomputes the blue plane, changing RED/GREEN or the alignment
+# file only recomputes the red/green planes. The frame is then just a stack of the three.
+plane_cache = ByteLRUCache(config.PLANE_CACHE_MB * 1024 * 1024)
+
+# blended_image.png is written in the background, see snapshot_writer.py.
+# Check snapshot_writer.write_times for how long each write took.
+snapshot_writer = SnapshotWriter(config.SNAPSHOT_FILE, enabled=config.SAVE_SNAPSHOT)
+
+# Resampling modes for fitting a layer to LITHO_SIZE_PX_X/Y (config.RESAMPLE_MODE):
+#   "exact"   - for black/white masks: never creates grey pixels. PIL's nearest neighbour, which for
+#               integer scale factors is exactly a pixel repeat (enlarging) or the centre sample of
+#               each block (shrinking); bench_resample.py checks that.
+#   "nearest" - nearest neighbour. Hard edges stay hard, fast.
+#   "bicubic" - PIL's default, what every layer used to get. Smooth for photos/greyscale.
+#   "area"    - box filter (average of the covered source pixels). Good when shrinking photos.
+#   "lanczos" - sharpest for greyscale, slowest, rings/greys out edges of binary masks.
+#   "auto"    - "exact" for black/white masks, "bicubic" for everything else (so greyscale
+#               layers come out the same as before).
+RESAMPLE_FILTERS = {
+    "exact": Image.Resampling.NEAREST,
+    "nearest": Image.Resampling.NEAREST,
+    "bicubic": Image.Resampling.BICUBIC,
+    "area": Image.Resampling.BOX,
+    "lanczos": Image.Resampling.LANCZOS,
+}
+
+def is_binary(img):
+    # True if every channel only uses 0 and 255 (a 1-bit mask, whatever format it was saved in)
+    hist = img.histogram()
+    return not any(any(hist[band * 256 + 1 : band * 256 + 255]) for band in range(len(img.getbands())))
+
+def resize_layer(img, size, mode):
+    # Fit a decoded RGB image to size = (width, height); returns a uint8 array.
+    size = tuple(size)
+    if img.size == size:
+        return np.array(img, dtype=np.uint8)
+    if mode == "auto":
+        mode = "exact" if is_binary(img) else "bicubic"
+    if mode not in RESAMPLE_FILTERS:
+        raise ValueError(f"Unknown resample mode {mode!r}, expected auto, {', '.join(RESAMPLE_FILTERS)}")
+    return np.array(img.resize(size=size, resample=RESAMPLE_FILTERS[mode]), dtype=np.uint8)
 
-    img_photo = img_photo.resize(size=(config.LITHO_SIZE_PX_X, config.LITHO_SIZE_PX_Y))
-    if img_photo.size != img_align.size:
-        img_align = img_align.resize(img_photo.size)
+def layer_key(img_path, size, resample=None):
+    # The file's modification time is part of the key, so re-saving a PNG invalidates it.
+    if resample is None:
+        resample = config.RESAMPLE_MODE
+    if svg_raster.is_svg(img_path):
+        # SVGs are rendered at the exact size instead of resampled, only antialiasing matters
+        resample = "svg-aa" if config.SVG_ANTIALIAS else "svg"
+    return (os.path.abspath(img_path), os.stat(img_path).st_mtime_ns, tuple(size), resample)
 
-    # Convert to numpy arrays, use int16 to avoid immediate overflow
-    arr1 = np.array(img_photo, dtype=np.int16)
-    arr2 = np.array(img_align, dtype=np.int16)
+def load_layer(img_path, size, resample=None):
+    # Returns the image fitted to the given (width, height), either as
+    # - a BitMask, if it is black/white (1 bit per pixel instead of 24), or
+    # - a read-only RGB uint8 array otherwise.
+    key = layer_key(img_path, size, resample)
+    arr = layer_cache.get(key)
+    if arr is None:
+        if svg_raster.is_svg(img_path):
+            arr = svg_raster.rasterize_svg(img_path, size)
+        else:
+            img = Image.open(img_path).convert("RGB")
+            arr = resize_layer(img, size, key[3])
+        mask = pack_if_binary(arr)
+        if mask is not None:
+            arr = mask
+        else:
+            arr.flags.writeable = False # Shared between calls, so nobody may modify it in place
+        layer_cache.put(key, arr)
+    return arr
 
+def apply_lut(layer, channel, lut, out):
+    # out = lut[layer channel]. A black/white BitMask only ever hits lut[0] and lut[255].
+    if isinstance(layer, BitMask):
+        return layer.expand_into(out, on=lut[255], off=lut[0])
+    return np.take(lut, layer[..., channel], out=out, mode="wrap")
+
+@lru_cache(maxsize=256)
+def brightness_lut(brightness):
+    # 256-entry table for one LED channel: value -> clip(value - (255 - brightness), 0, 255).
+    # This is exactly what the old int16 "add offset and clip" math did, per pixel.
+    lut = np.clip(np.arange(256, dtype=np.int16) - (255 - int(brightness)), 0, 255).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+def composite_layers(arr_photo, arr_align, uv, red, green, out=None):
     # PNGs come in with white representing UV exposed areas and black representing no UV exposure.
     # Technically, only the BLUE values matter for the photo layer.
     # Both RED and GREEN values are dropped.
     # The opposite is true for the align layer. Only the RED matters, and green and blue are dropped.
     # Because white pictures already contain all three, it's best to draw in white for compatibility with both.
+    #
+    # Each output channel only comes from one layer, so the whole thing is three table lookups
+    # written straight into the output buffer (no int16 copies, no intermediate frames).
+    # Pass a preallocated (height, width, 3) uint8 array as `out` to reuse it between frames.
+    # A (height, width, 4) buffer also works; the 4th byte is filled with 255 (RGBX).
+    # Either layer may also be a BitMask, which is expanded straight into its output planes.
+    if out is None:
+        out = np.empty(arr_photo.shape[:2] + (3,), dtype=np.uint8)
+    apply_lut(arr_align, 0, brightness_lut(red), out[..., 0])
+    apply_lut(arr_align, 1, brightness_lut(green), out[..., 1])
+    apply_lut(arr_photo, 2, brightness_lut(uv), out[..., 2])
+    if out.shape[2] == 4:
+        out[..., 3] = 255
+    return out
+
+class ArrayQImage(QImage):
+    # A QImage that points straight at a numpy frame's memory instead of copying it.
+    # The array is kept on the image, so it can't be freed while the image is alive.
+    #
+    # NOTE: Qt doesn't know about the numpy array. Anything that has to outlive this Python
+    # object (or cross to another thread) should be a QPixmap or a QImage.copy() of it.
+    FORMATS = {3: QImage.Format_RGB888, 4: QImage.Format_RGBX8888}
+
+    def __init__(self, frame):
+        if frame.dtype != np.uint8 or frame.ndim != 3 or frame.shape[2] not in self.FORMATS:
+            raise ValueError(f"Expected a (height, width, 3 or 4) uint8 frame, got {frame.dtype} {frame.shape}")
+        frame = np.ascontiguousarray(frame) # No-op for frames from composite_layers
+        height, width, channels = frame.shape
+        super().__init__(frame.data, width, height, frame.strides[0], self.FORMATS[channels])
+        self.frame = frame
+
+def frame_to_qimage(frame):
+    # Wrap an RGB (Format_RGB888) or RGBX (Format_RGBX8888) frame as a QImage without copying.
+    return ArrayQImage(frame)
+
+# Which channel of which layer feeds each output plane (see composite_layers)
+PLANE_SOURCES = {"red": 0, "green": 1, "blue": 2}
 
-    # Add arrays and clip values to stay within the valid 0-255 range
-    added_arr1 = np.clip(arr1 + [-255, -255, -(255-config.BRIGHTNESS_UV)], 0, 255).astype(np.uint8) # Only keep blue
-    added_arr2 = np.clip(arr2 + [-(255-config.BRIGHTNESS_RED), -(255-config.BRIGHTNESS_GREEN), -255], 0, 255).astype(np.uint8) # Only keep red
-    added_arr = np.clip(added_arr1 + added_arr2, 0, 255).astype(np.uint8)
+def layer_plane(img_path, channel, brightness, size):
+    # One output plane: a layer's channel pushed through that channel's brightness table.
+    # Cached on (layer, channel, brightness), so it is only recomputed when one of those changes.
+    # The UV plane also gets the flat-field gain map, if one is set (see flat_field.py).
+    gain_key = flat_field.gain_key() if channel == "blue" else None
+    key = (layer_key(img_path, size), channel, int(brightness), gain_key)
+    plane = plane_cache.get(key)
+    if plane is None:
+        layer = load_layer(img_path, size)
+        plane = np.empty((size[1], size[0]), dtype=np.uint8)
+        apply_lut(layer, PLANE_SOURCES[channel], brightness_lut(brightness), plane)
+        if gain_key is not None:
+            flat_field.compensate(plane)
+        plane.flags.writeable = False
+        plane_cache.put(key, plane)
+    return plane
+
+def composite_frame(img_photo_path, img_align_path, uv, red, green, size):
+    # Decode (cached) and composite both layers into a new RGB frame.
+    # Same result as composite_layers(), but built from cached per-layer planes,
+    # so only the planes whose inputs changed are recomputed. The frame is then
+    # pre-warped for the optics when a distortion calibration is set (see distortion.py).
+    # No Qt objects are touched here, so this is safe to run on a worker thread.
+    red_plane = layer_plane(img_align_path, "red", red, size)
+    green_plane = layer_plane(img_align_path, "green", green, size)
+    blue_plane = layer_plane(img_photo_path, "blue", uv, size)
+    out = np.empty(blue_plane.shape + (3,), dtype=np.uint8)
+    frame = np.stack((red_plane, green_plane, blue_plane), axis=-1, out=out)
+    return distortion.correct(frame) # Pre-warp for the projection optics, if calibrated
+
+def dose_map(img_path, size):
+    # A layer's blue channel as a greyscale UV dose map (see dose_planes.py), through the same stages
+    # composite_frame gives the UV plane: the flat-field gain, then the pre-warp for the optics.
+    # They are applied once to the dose map instead of to every bit plane; with nearest-neighbour
+    # warping that gives the same planes, and with "linear" the dose is interpolated before splitting.
+    layer = load_layer(img_path, size)
+    dose = layer.to_array() if isinstance(layer, BitMask) else np.array(layer[..., PLANE_SOURCES["blue"]])
+    flat_field.compensate(dose)
+    return distortion.correct(dose)
+
+def frame_to_pixmap(frame):
+    # QPixmaps may only be created on the GUI thread.
+    return QPixmap.fromImage(frame_to_qimage(frame))
+
+# Finished frames, ready to display, for the last few mask/brightness combinations.
+# Switching back to a previous setting then skips decoding and compositing entirely.
+# Each entry is (QPixmap, RGB frame); the frame is kept for the snapshot writer.
+# GUI thread only, since it holds QPixmaps.
+def frame_entry_nbytes(entry):
+    pixmap, frame = entry
+    return pixmap.width() * pixmap.height() * pixmap.depth() // 8 + frame.nbytes
+
+frame_cache = ByteLRUCache(config.FRAME_CACHE_MB * 1024 * 1024, sizeof=frame_entry_nbytes)
+
+def frame_key(img_photo_path, img_align_path, uv, red, green, size):
+    return (layer_key(img_photo_path, size), layer_key(img_align_path, size), int(uv), int(red), int(green),
+            flat_field.gain_key(), distortion_key())
+
+def distortion_key():
+    # Frames are pre-warped, so a different calibration makes a different frame
+    if not config.DISTORTION_CALIBRATION:
+        return None
+    return (distortion.calibration_sha256(config.DISTORTION_CALIBRATION), config.DISTORTION_INTERPOLATION)
+
+def cached_frame(img_photo_path, img_align_path, uv, red, green, size):
+    # Returns (pixmap, frame) for these exact settings, or None if they haven't been composited yet.
+    return frame_cache.get(frame_key(img_photo_path, img_align_path, uv, red, green, size))
+
+def store_frame(request, frame):
+    # Turn a finished frame into a pixmap and remember both under its settings.
+    # request is (img_photo_path, img_align_path, uv, red, green, size), as passed to composite_frame().
+    pixmap = frame_to_pixmap(frame)
+    frame_cache.put(frame_key(*request), (pixmap, frame))
+    return pixmap
+
+def add_images(img_photo_path, img_align_path):
+    
+    size = (config.LITHO_SIZE_PX_X, config.LITHO_SIZE_PX_Y)
+    request = (img_photo_path, img_align_path, config.BRIGHTNESS_UV, config.BRIGHTNESS_RED, config.BRIGHTNESS_GREEN, size)
+    cached = cached_frame(*request)
+    if cached is not None:
+        pixmap, added_arr = cached
+    else:
+        added_arr = composite_frame(*request)
+        pixmap = store_frame(request, added_arr)
 
-    # Convert back to PIL Image and then to QImage
-    blended_img = Image.fromarray(added_arr, 'RGB')
-    blended_img.save("blended_image.png")
-    blended_img_data = blended_img.tobytes("raw", "RGBA")
-    blended_q_img = QImage(blended_img_data, blended_img.width, blended_img.height, QImage.Format_RGBA8888)
-    # return blended_q_img
+    # Save a copy for reference (on a worker thread, added_arr isn't touched after this)
+    snapshot_writer.submit(added_arr)
 
     # Create blended image
-    pixmap = QPixmap.fromImage(blended_q_img)
     graphicsPixmapItem = QGraphicsPixmapItem(pixmap)
     return graphicsPixmapItem
 
@@ -1,19 +1,131 @@
-# Paste the relative path of whatever picture you want to invert at the bottom of this code
-# Useful for fixing black stencils (white lines will be UV light, black will be darkness)
+# Inverts pictures: useful for fixing black stencils (white lines will be UV light, black will be darkness)
+#
+# Usage:
+#   python invert_image.py "png_images/25 EGen Logo Text.png"   -> inverted_images/25 EGen Logo Text.png
+#   python invert_image.py png_images other_stencils -j 8       -> every picture in those folders
+#   python invert_image.py png_images -o inverted_stencils --force
+#
+# Every input gets its own output PNG. By default outputs go in an "inverted_images" folder in
+# the current directory (not inside png_images, where the GUI would list it as a mask), and
+# inputs whose output is already newer than the input are skipped. Inputs that would write the
+# same output (a.png and a.bmp both make a.png) are refused before anything is converted.
+# Folders are converted in parallel on a process pool (one process per CPU by default).
 
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 from PIL import Image
+from bitmask import pack_if_binary
 
-def invert_image(img_path):
-    # ... inside a function ...
+IMAGE_EXTENSIONS = (".png", ".bmp", ".jpg", ".jpeg", ".tif", ".tiff")
+OUTPUT_FOLDER = "inverted_images"
+
+
+def invert_image(img_path, out_path="inverted_image.png"):
     img_photo = Image.open(img_path).convert("RGB")
+    arr = np.array(img_photo)  # Our own writable uint8 copy
+
+    # Black/white stencils are flipped 8 pixels at a time as packed bits,
+    # and saved as a 1-bit PNG (it loads back the same, just smaller).
+    mask = pack_if_binary(arr)
+    if mask is not None:
+        mask.invert().to_image().save(out_path)
+        return
+
+    # For uint8, bitwise NOT is exactly 255 - value, so no wider copy or clipping is needed
+    np.invert(arr, out=arr)
+    Image.fromarray(arr, 'RGB').save(out_path)
+
+
+def output_path(img_path, out_dir=None):
+    """Where the inverted copy of img_path goes (always a PNG)"""
+    if out_dir is None:
+        out_dir = OUTPUT_FOLDER
+    name = os.path.splitext(os.path.basename(img_path))[0] + ".png"
+    return os.path.join(out_dir, name)
+
+
+def is_up_to_date(img_path, out_path):
+    return os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(img_path)
+
+
+def find_images(paths):
+    """Expand folders (not recursively) into the pictures they contain; files are kept as they are"""
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(os.path.join(path, name)):
+                    images.append(os.path.join(path, name))
+        else:
+            images.append(path)
+    return images
+
+
+def _invert_job(img_path, out_path):
+    # Runs in a worker process
+    start = time.perf_counter()
+    invert_image(img_path, out_path)
+    return time.perf_counter() - start
+
+
+def invert_batch(paths, out_dir=None, jobs=None, force=False):
+    """Invert every picture in `paths` (files and/or folders). Returns (converted, skipped, failed) counts."""
+    outputs = {}
+    for img_path in find_images(paths):
+        outputs.setdefault(os.path.normcase(os.path.abspath(output_path(img_path, out_dir))), []).append(img_path)
+    collisions = [inputs for inputs in outputs.values() if len(inputs) > 1]
+    if collisions:
+        raise ValueError("These inputs would overwrite each other's output: "
+                         + "; ".join(", ".join(inputs) for inputs in collisions))
+
+    work = []
+    skipped = 0
+    for inputs in outputs.values():
+        img_path = inputs[0]
+        out_path = output_path(img_path, out_dir)
+        if not force and is_up_to_date(img_path, out_path):
+            skipped += 1
+            continue
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+        work.append((img_path, out_path))
+
+    converted = failed = 0
+    if work:
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(_invert_job, img_path, out_path): (img_path, out_path) for img_path, out_path in work}
+            # Report each file as soon as it's done, in whatever order they finish
+            for future in as_completed(futures):
+                img_path, out_path = futures[future]
+                try:
+                    seconds = future.result()
+                    converted += 1
+                    print(f"{img_path} -> {out_path} ({seconds * 1000:.0f} ms)")
+                except Exception as e:
+                    failed += 1
+                    print(f"Could not invert {img_path}: {e}")
+        print(f"Inverted {converted} images in {time.perf_counter() - start:.2f} s")
+    print(f"{converted} converted, {skipped} up to date, {failed} failed")
+    return converted, skipped, failed
+
 
-    arr = np.array(img_photo, dtype=np.int16)
-    arr = np.clip(255 - arr, 0, 255).astype(np.uint8)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Invert black/white stencils (and other pictures)")
+    parser.add_argument("paths", nargs="+", help="Pictures and/or folders of pictures")
+    parser.add_argument("-o", "--output-dir", help=f"Put all outputs here (default: '{OUTPUT_FOLDER}')")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Worker processes (default: one per CPU)")
+    parser.add_argument("--force", action="store_true", help="Convert even if the output is newer than the input")
+    args = parser.parse_args(argv)
+    try:
+        converted, skipped, failed = invert_batch(args.paths, args.output_dir, args.jobs, args.force)
+    except ValueError as e:
+        print(e)
+        return 1
+    return 1 if failed else 0
 
-    # Convert back to PIL Image and then to QImage
-    blended_img = Image.fromarray(arr, 'RGB')
-    blended_img.save("inverted_image.png")
 
-### PASTE DIRECTORY IN THIS FUNCTION: ###
-invert_image("png_images\\25 EGen Logo Text.png")
\ No newline at end of file
+if __name__ == "__main__":
+    raise SystemExit(main())
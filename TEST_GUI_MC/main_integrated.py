@@ -25,7 +25,12 @@ _ Prevent dragging window into DLP or moving mouse onto it... Might get really t
 
 import sys, os
 import config, image_processing
+from preview_worker import PreviewWorker
+from exposure_timer import ExposureTimer
+from dlp_output import DLPSurfaces
 from stage_controller import StageController  # Import the new stage controller
+from step_repeat import StepRepeatJob, load_sites
+import site_order
 from PyQt5.QtWidgets import (
     QApplication, 
     QMainWindow, 
@@ -46,10 +51,11 @@ from PyQt5.QtWidgets import (
     QPushButton,
     QSpacerItem,
     QMessageBox,
+    QFileDialog,
     QSizePolicy
 )
 from PyQt5.QtSvg import QGraphicsSvgItem
-from PyQt5.QtCore import Qt, QSize, QRectF
+from PyQt5.QtCore import Qt, QSize, QRectF, QTimer
 from PyQt5.QtGui import QResizeEvent, QBrush, QColor
 
 png_images = os.listdir("png_images")
@@ -105,6 +111,7 @@ class MainWindow(QMainWindow): # Main GUI for controlling photolithography setti
         self.layout_middle = QVBoxLayout()
         self.layout_right = QVBoxLayout()
         self.layout_exposure = QHBoxLayout()
+        self.layout_step_repeat = QHBoxLayout()
         self.layout_circle = QHBoxLayout()
         self.layout_circle_dia = QVBoxLayout()
         self.layout_circle_offset_x = QVBoxLayout()
@@ -196,6 +203,21 @@ class MainWindow(QMainWindow): # Main GUI for controlling photolithography setti
         self.DLP_preview_scene.addItem(self.photo_and_align_graphics_item)
         self.DLP_preview_view = GraphicsView(self.DLP_preview_scene, self)
 
+        # Later updates are composited in the background and swapped in when ready
+        self.preview_worker = PreviewWorker(self)
+        self.preview_worker.frameReady.connect(self.show_preview_frame)
+        self.preview_worker.failed.connect(lambda request, error: print(f"Preview update failed: {error}"))
+
+        # Live preview while dragging sliders: at most one recomposite per display refresh.
+        # Values in between are skipped (the worker only ever computes the newest request).
+        refresh_rate = QApplication.primaryScreen().refreshRate() or 60.0
+        self.live_preview_timer = QTimer(self)
+        self.live_preview_timer.setSingleShot(True)
+        self.live_preview_timer.setTimerType(Qt.PreciseTimer)
+        self.live_preview_timer.setInterval(max(1, round(1000 / refresh_rate)))
+        self.live_preview_timer.timeout.connect(self.live_preview_tick)
+        self.live_preview_dirty = False
+
         
 
         # Output resolution:
@@ -216,6 +238,15 @@ class MainWindow(QMainWindow): # Main GUI for controlling photolithography setti
         self.exposure_STOP.setStyleSheet("background-color: red; color: white; font-weight: bold;")
         self.exposure_START = QPushButton("START")
         self.exposure_START.setStyleSheet("background-color: green; color: white; font-weight: bold;")
+        self.exposure_result_label = QLabel("Exposure time 0 = stays on until STOP")
+
+        # Turns the pattern off after the exposure time and measures how long it was really on
+        self.exposure_timer = ExposureTimer(self)
+        self.exposure_timer.finished.connect(self.exposureFinished)
+        # Step and repeat (see step_repeat.py)
+        self.step_repeat_button = QPushButton("Step && Repeat...")
+        self.step_repeat_label = QLabel("")
+        self.step_repeat_job = None
 
         # Alignment SVG layer
         self.alignment_svg_checkbox = QCheckBox("Draw alignment image on wafer")
@@ -256,6 +287,10 @@ class MainWindow(QMainWindow): # Main GUI for controlling photolithography setti
         self.layout_exposure.addWidget(self.exposure_STOP)
         self.layout_exposure.addWidget(self.exposure_START)
         self.layout_right.addLayout(self.layout_exposure)
+        self.layout_right.addWidget(self.exposure_result_label)
+        self.layout_step_repeat.addWidget(self.step_repeat_button)
+        self.layout_step_repeat.addWidget(self.step_repeat_label)
+        self.layout_right.addLayout(self.layout_step_repeat)
         self.layout_right.addWidget(self.alignment_svg_checkbox)
         self.layout_right.addWidget(self.alignment_circle_checkbox)
         self.layout_right.addWidget(self.alignment_circle_text)
@@ -282,9 +317,14 @@ class MainWindow(QMainWindow): # Main GUI for controlling photolithography setti
         self.photo_slider_UV.valueChanged.connect(lambda: self.photo_text_UV.setText(f'UV LED Brightness: {self.photo_slider_UV.value()}')) # Update text while moving
         self.assist_slider_RED.valueChanged.connect(lambda: self.assist_text_RED.setText(f'Red LED Brightness: {self.assist_slider_RED.value()}'))
         self.assist_slider_GREEN.valueChanged.connect(lambda: self.assist_text_GREEN.setText(f'Green LED Brightness: {self.assist_slider_GREEN.value()}'))
+        if config.LIVE_PREVIEW: # Also update images while moving
+            self.photo_slider_UV.valueChanged.connect(self.live_preview_changed)
+            self.assist_slider_RED.valueChanged.connect(self.live_preview_changed)
+            self.assist_slider_GREEN.valueChanged.connect(self.live_preview_changed)
         # Start/stop buttons
         self.exposure_START.clicked.connect(self.confirmStart)
         self.exposure_STOP.clicked.connect(self.stopPhotolithography)
+        self.step_repeat_button.clicked.connect(self.startStepRepeat)
 
     def update_UV_value(self):
         value = self.photo_slider_UV.value()
@@ -301,6 +341,22 @@ class MainWindow(QMainWindow): # Main GUI for controlling photolithography setti
         config.BRIGHTNESS_GREEN = value
         self.update_images()
 
+    def live_preview_changed(self):
+        config.BRIGHTNESS_UV = self.photo_slider_UV.value()
+        config.BRIGHTNESS_RED = self.assist_slider_RED.value()
+        config.BRIGHTNESS_GREEN = self.assist_slider_GREEN.value()
+        if self.live_preview_timer.isActive():
+            self.live_preview_dirty = True # Picked up when the current refresh interval ends
+        else:
+            self.update_images()
+            self.live_preview_timer.start()
+
+    def live_preview_tick(self):
+        if self.live_preview_dirty:
+            self.live_preview_dirty = False
+            self.update_images()
+            self.live_preview_timer.start()
+
     def update_images(self):
         # Update Photo image
         selected_file = self.photo_cbox.currentText()
@@ -311,10 +367,33 @@ class MainWindow(QMainWindow): # Main GUI for controlling photolithography setti
         config.ALIGNMENT_FILE = os.path.join("png_images", selected_file)
         self.assist_text_file.setText(f'Image File: {config.ALIGNMENT_FILE}')
 
-        # Remove the old pixmap item, add a newly calculated one
-        self.DLP_preview_scene.removeItem(self.photo_and_align_graphics_item)
-        self.photo_and_align_graphics_item = image_processing.add_images(config.PHOTO_FILE, config.ALIGNMENT_FILE)
-        self.DLP_preview_scene.addItem(self.photo_and_align_graphics_item)
+        # Settings are read now, so a slider moving mid-composite can't mix old and new values.
+        request = (config.PHOTO_FILE, config.ALIGNMENT_FILE,
+                   config.BRIGHTNESS_UV, config.BRIGHTNESS_RED, config.BRIGHTNESS_GREEN,
+                   (config.LITHO_SIZE_PX_X, config.LITHO_SIZE_PX_Y))
+
+        # Seen these exact settings before? Show the finished frame right away.
+        cached = image_processing.cached_frame(*request)
+        if cached is not None:
+            self.preview_worker.cancel() # Anything still in progress is older than this
+            pixmap, frame = cached
+            self.show_preview_pixmap(pixmap, frame)
+            return
+
+        # Otherwise composite on a worker thread; show_preview_frame() swaps the result in.
+        self.preview_worker.request(*request)
+
+    def show_preview_frame(self, serial, request, frame):
+        # Runs on the GUI thread once the worker has a finished frame.
+        # The DLP window shows this same scene, so it updates too.
+        if not self.preview_worker.is_current(serial):
+            return # Queued before a newer frame (e.g. a cache hit) was shown, don't put the old one back
+        self.show_preview_pixmap(image_processing.store_frame(request, frame), frame)
+
+    def show_preview_pixmap(self, pixmap, frame):
+        image_processing.snapshot_writer.submit(frame)
+        self.photo_and_align_graphics_item.setPixmap(pixmap)
+        lithoWindow.surfaces.set_frame(pixmap) # Mid-exposure changes go straight to the DLP, as before (kept back during a step and repeat job)
     
     def confirmStart(self):
         warning = QMessageBox()
@@ -344,27 +423,114 @@ class MainWindow(QMainWindow): # Main GUI for controlling photolithography setti
         if button == cancelButton:
             print("Canceled.")
 
+    def startStepRepeat(self):
+        # Pick a site list, confirm, and run it (move, settle, expose at every site)
+        if self.step_repeat_job is not None and self.step_repeat_job.isRunning():
+            print("A step and repeat job is already running.")
+            return
+        csv_path, _ = QFileDialog.getOpenFileName(self, "Site list", "", "Site lists (*.csv)")
+        if not csv_path:
+            return
+        try:
+            sites = load_sites(csv_path, config.PHOTO_FILE, config.ALIGNMENT_FILE, self.exposure_spinbox.value())
+        except Exception as e:
+            print(f"Could not read site list: {e}")
+            return
+        start = (self.stage_controller.position_x, self.stage_controller.position_y)
+        sites = site_order.plan(sites, config.SITE_ORDER, start)
+        estimate = site_order.estimate_duration(sites, start)
+        button = QMessageBox.warning(self, "CONFIRM UV EXPOSURE",
+            f"CAUTION! UV LEDs will turn on at {len(sites)} sites while the stage moves.\n"
+            "Ensure the working area is clear and eye protection is being used.\n\n"
+            f"Estimated job time: {site_order.format_duration(estimate['total'])} "
+            f"(stage travel {site_order.format_duration(estimate['move'])}, sites in {config.SITE_ORDER} order)",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.Cancel, QMessageBox.StandardButton.Cancel)
+        if button != QMessageBox.StandardButton.Yes:
+            print("Canceled.")
+            return
+
+        self.step_repeat_job = StepRepeatJob(sites, start, parent=self)
+        self.step_repeat_job.positionChanged.connect(self.stepRepeatMoved)
+        self.step_repeat_job.exposeFrame.connect(self.stepRepeatExpose)
+        self.step_repeat_job.blackout.connect(lambda number: lithoWindow.blackout())
+        self.step_repeat_job.siteDone.connect(self.stepRepeatSiteDone)
+        self.step_repeat_job.jobDone.connect(self.stepRepeatDone)
+        lithoWindow.surfaces.hold() # Preview updates stay off the DLP until the job is done
+        self.step_repeat_job.start()
+
+    def stepRepeatMoved(self, x, y):
+        self.stage_controller.position_x = x
+        self.stage_controller.position_y = y
+        self.stage_controller.update_position_display()
+
+    def stepRepeatExpose(self, number, frame):
+        if self.step_repeat_job.stopped():
+            return # Queued before STOP (or the E-stop, or a display timeout); the UV stays off
+        self.step_repeat_label.setText(f"Site {number + 1} of {len(self.step_repeat_job.sites)}: exposing")
+        pixmap = image_processing.frame_to_pixmap(frame)
+        self.photo_and_align_graphics_item.setPixmap(pixmap)
+        lithoWindow.surfaces.exposure_page.set_frame(pixmap) # Past the hold, this is the job's own frame
+        self.showExposure() # The job times the exposure itself
+        self.step_repeat_job.frame_displayed()
+
+    def stepRepeatSiteDone(self, timing):
+        print("Site {site} ({x}, {y}): move {move:.3f} s, settle {settle:.3f} s, idle {idle:.3f} s, "
+              "expose {expose:.3f} s (frame prepared in {prepare:.3f} s)".format(**timing))
+
+    def stepRepeatDone(self, completed):
+        lithoWindow.blackout()
+        lithoWindow.surfaces.release(update=False)
+        job = self.step_repeat_job
+        self.step_repeat_label.setText(f"{len(job.timings)} of {len(job.sites)} sites exposed" + ("" if completed else " (stopped)"))
+        try:
+            job.save_report(config.STEP_REPEAT_REPORT)
+        except Exception as e:
+            print(f"Could not save step and repeat report: {e}")
+        self.update_images() # Back to the selected images
+
     def resizeEvent(self, event):
         super().resizeEvent(event)
 
     def closeEvent(self, a0):
+        image_processing.snapshot_writer.stop(2.0) # Don't cut blended_image.png off halfway through a write
         exit() # Close the whole program if the main window is closed.
         # NOTE: The default splash of the DLP MUST be a black screen, or something with NO blue.
         #       Otherwise, it will emit UV light when the splash screen (or "No-signal" screen) takes over.
 
     def startPhotolithography(self):
         print("Starting UV exposure...")
-        lithoWindow.DLP_scene = self.DLP_preview_scene
-        # lithoWindow.DLP_scene = QGraphicsScene()
-        # lithoWindow.DLP_scene.addItem(self.photo_and_align_graphics_item)
-        lithoWindow.DLP_view = QGraphicsView(lithoWindow.DLP_scene, self)
-        lithoWindow.DLP_view.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        lithoWindow.DLP_view.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        lithoWindow.setCentralWidget(lithoWindow.DLP_view)
+        duration = self.exposure_spinbox.value()
+        if duration > 0:
+            self.exposure_result_label.setText(f"Exposing for {duration:.2f} s...")
+            self.exposure_timer.start(duration, self.showExposure, lithoWindow.blackout)
+        else:
+            self.showExposure() # No time set, on until STOP is clicked
+
+    def showExposure(self):
+        # Switch the DLP to the (pre-built) exposure surface and return the page showing it
+        return lithoWindow.surfaces.show_exposure()
 
     def stopPhotolithography(self):
         print("STOPPING UV exposure.")
-        lithoWindow.blackout()
+        if self.step_repeat_job is not None:
+            self.step_repeat_job.stop()
+        if self.exposure_timer.active():
+            self.exposure_timer.cancel() # Blacks out and logs the shortened exposure
+        else:
+            lithoWindow.blackout()
+
+    def exposureFinished(self, result):
+        if result["measured_s"] is None:
+            text = f"Exposure ended after {result['commanded_s']:.3f} s (DLP not displayed)"
+        else:
+            text = f"Last exposure: {result['measured_s']:.4f} s on ({result['error_ms']:+.2f} ms)"
+        count, mean, worst = self.exposure_timer.error_stats()
+        if count > 1:
+            text += f", session mean {mean:+.2f} ms, worst {worst:.2f} ms over {count}"
+        switches, switch_mean, switch_worst = lithoWindow.surfaces.switch_stats()
+        if switches:
+            text += f"; DLP switch {switch_mean:.2f} ms mean, {switch_worst:.2f} ms worst"
+        self.exposure_result_label.setText(text + (" - STOPPED" if result["aborted"] else ""))
 
 class DLP():
     def __init__(self):
@@ -408,17 +574,17 @@ class LithoWindow(QMainWindow): # Create the window that the DLP will receieve
             except Exception as e:
                 print(e)
         
+        # Both DLP surfaces are built once here; exposing and blacking out just switch between them.
+        # The exposure surface gets the same frame as the DLP preview, drawn 1:1.
+        self.surfaces = DLPSurfaces()
+        self.surfaces.set_frame(parentWindow.photo_and_align_graphics_item.pixmap())
+        self.setCentralWidget(self.surfaces)
+
         # Finish setting up the window by blacking everything out.
         self.blackout()
 
     def blackout(self):
-        self.blackout_scene = QGraphicsScene()
-        self.blackout_scene.setBackgroundBrush(QBrush(QColor(0, 0, 0))) # Total darkness *evil laugh*
-        self.blackout_view = QGraphicsView(self.blackout_scene)
-        self.blackout_view.setAutoFillBackground(True)
-        self.blackout_view.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        self.blackout_view.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        self.setCentralWidget(self.blackout_view)
+        return self.surfaces.show_blackout()
 
 
 app = QApplication(sys.argv)
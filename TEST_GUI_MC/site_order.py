@@ -0,0 +1,149 @@
+# Orders step-and-repeat sites to cut down stage travel time, and estimates how long a job takes.
+#
+# Stage time model: mcu_side.move_motor drives one axis at a time, and every step is a
+# high + low pulse of STEP_DELAY each. So a move from (x0, y0) to (x1, y1) takes
+#   |x1 - x0| * 2 * step_delay_x  +  |y1 - y0| * 2 * step_delay_y  (+ a fixed overhead per axis moved)
+# i.e. travel time is a weighted Manhattan distance, not a straight line.
+#
+# Orderings:
+#   "listed"     - as given
+#   "serpentine" - row by row (by y), alternating direction, like reading a boustrophedon
+#   "nearest"    - always go to the closest unvisited site next (greedy)
+#   "2-opt"      - the quicker of serpentine and nearest, then repeatedly reverse stretches of
+#                  the route while that saves time (serpentine is hard to beat on a full grid,
+#                  nearest does better on scattered sites). Opt-in: it can take up to
+#                  TWO_OPT_TIME_LIMIT, and the GUI plans before its confirmation dialog, so the
+#                  window is frozen meanwhile. On big grids serpentine is already about as short.
+# plan() returns a new site list; sites are the dicts from step_repeat (x, y, ...).
+
+import time
+import numpy as np
+import config
+import mcu_side
+
+ORDERINGS = ["listed", "serpentine", "nearest", "2-opt"]
+TWO_OPT_TIME_LIMIT = 5.0  # Seconds the 2-opt pass may spend improving a route
+
+
+class StageTimeModel:
+    """Move durations for the stepper stage, moving X then Y (see mcu_side.move_motor)"""
+
+    def __init__(self, step_delay_x=None, step_delay_y=None, axis_overhead=0.0):
+        self.step_delay_x = mcu_side.STEP_DELAY if step_delay_x is None else step_delay_x
+        self.step_delay_y = mcu_side.STEP_DELAY if step_delay_y is None else step_delay_y
+        self.axis_overhead = axis_overhead  # Seconds per axis that actually moves (call/setup time)
+
+    def move_time(self, dx, dy):
+        """Seconds to move by (dx, dy) steps; works on numbers or numpy arrays"""
+        dx, dy = np.abs(dx), np.abs(dy)
+        return (dx * 2 * self.step_delay_x + dy * 2 * self.step_delay_y
+                + self.axis_overhead * ((dx > 0).astype(float) + (dy > 0).astype(float)))
+
+    def route_time(self, points, start=(0, 0)):
+        """Total travel time through (N, 2) points in order, starting from `start`"""
+        path = np.vstack([np.asarray(start, dtype=np.float64)[None], np.asarray(points, dtype=np.float64).reshape(-1, 2)])
+        steps = np.diff(path, axis=0)
+        return float(np.sum(self.move_time(steps[:, 0], steps[:, 1])))
+
+
+def _points(sites):
+    return np.array([(site["x"], site["y"]) for site in sites], dtype=np.float64).reshape(-1, 2)
+
+
+def serpentine_order(points):
+    """Indexes row by row (equal y), left to right then right to left"""
+    rows = np.unique(points[:, 1])
+    order = []
+    for number, y in enumerate(rows):
+        row = np.nonzero(points[:, 1] == y)[0]
+        row = row[np.argsort(points[row, 0], kind="stable")]
+        order.extend(row[::-1] if number % 2 else row)
+    return np.array(order, dtype=np.intp)
+
+
+def nearest_order(points, model, start=(0, 0)):
+    """Greedy route: always the closest (in move time) unvisited site next"""
+    count = len(points)
+    visited = np.zeros(count, dtype=bool)
+    order = np.empty(count, dtype=np.intp)
+    current = np.asarray(start, dtype=np.float64)
+    for number in range(count):
+        cost = model.move_time(points[:, 0] - current[0], points[:, 1] - current[1])
+        cost[visited] = np.inf
+        best = int(np.argmin(cost))
+        order[number] = best
+        visited[best] = True
+        current = points[best]
+    return order
+
+
+def two_opt(points, order, model, start=(0, 0), time_limit=TWO_OPT_TIME_LIMIT):
+    """Improve a route by reversing stretches of it (2-opt) until nothing helps or time runs out.
+
+    The route is open: it starts at `start` and ends wherever the last site is. For each
+    route position i, all possible reversal end points j are tried at once with numpy.
+    """
+    path = np.vstack([np.asarray(start, dtype=np.float64)[None], points[order]])
+    order = np.array(order, dtype=np.intp)
+    count = len(path)  # Route positions, 0 is the start (never moved)
+
+    def cost(a, b):
+        return model.move_time(a[..., 0] - b[..., 0], a[..., 1] - b[..., 1])
+
+    deadline = time.perf_counter() + time_limit
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for i in range(count - 2):
+            # Reversing path[i + 1 .. j] replaces edges (i, i+1) and (j, j+1) with (i, j) and (i+1, j+1).
+            # For the last j there is no (j, j+1) edge, as the route ends there.
+            j = np.arange(i + 2, count)
+            after = np.minimum(j + 1, count - 1)
+            has_next = j + 1 < count
+            old = cost(path[i], path[i + 1]) + np.where(has_next, cost(path[j], path[after]), 0.0)
+            new = cost(path[i], path[j]) + np.where(has_next, cost(path[i + 1], path[after]), 0.0)
+            gain = old - new
+            best = int(np.argmax(gain))
+            if gain[best] > 1e-12:
+                end = int(j[best])
+                path[i + 1:end + 1] = path[i + 1:end + 1][::-1].copy()
+                order[i:end] = order[i:end][::-1].copy()  # order[k] is route position k + 1
+                improved = True
+            if time.perf_counter() >= deadline:
+                break
+    return order
+
+
+def plan(sites, ordering="serpentine", start=(0, 0), model=None, time_limit=TWO_OPT_TIME_LIMIT):
+    """Sites reordered with one of ORDERINGS"""
+    if ordering not in ORDERINGS:
+        raise ValueError(f"Unknown site ordering {ordering}, expected one of {ORDERINGS}")
+    if len(sites) < 2 or ordering == "listed":
+        return list(sites)
+    model = model if model is not None else StageTimeModel()
+    points = _points(sites)
+    if ordering == "serpentine":
+        order = serpentine_order(points)
+    elif ordering == "nearest":
+        order = nearest_order(points, model, start)
+    else:
+        candidates = [serpentine_order(points), nearest_order(points, model, start)]
+        order = min(candidates, key=lambda candidate: model.route_time(points[candidate], start))
+        order = two_opt(points, order, model, start, time_limit)
+    return [sites[index] for index in order]
+
+
+def estimate_duration(sites, start=(0, 0), model=None, settle_time=None):
+    """Estimated job time in seconds: {"move", "settle", "expose", "total"}"""
+    model = model if model is not None else StageTimeModel()
+    settle_time = config.STAGE_SETTLE_TIME if settle_time is None else settle_time
+    move = model.route_time(_points(sites), start) if sites else 0.0
+    settle = settle_time * len(sites)
+    expose = sum(site["exposure"] for site in sites)
+    return {"move": move, "settle": settle, "expose": expose, "total": move + settle + expose}
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
@@ -0,0 +1,191 @@
+# Step-and-repeat exposure: expose a pattern at every site of a list, moving the stage in between.
+#
+# The job runs on its own QThread, so the GUI stays responsive while the stage moves.
+# Each site goes through:
+#   move   - mcu_side.move_motor, X then Y, from the current position to the site
+#   settle - config.STAGE_SETTLE_TIME to let vibrations die down
+#   (idle) - waiting for the site's frame; should be ~0, see below
+#   expose - the GUI shows the frame on the DLP, and it stays up for the site's exposure time
+# Frames are composited one site ahead on a background thread: while the stage drives to
+# site N, site N+1's frame is being prepared, so the projector never waits on image work
+# (unless compositing takes longer than a whole move + exposure).
+#
+# Site list CSV (header row required, x/y in motor steps from the stage datum):
+#   x,y,photo,align,exposure
+#   0,0,png_images/A.png,png_images/B.png,12.5
+#   2000,0,,,
+# Empty/missing photo, align or exposure columns use the job defaults (the current GUI selection).
+
+import csv
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QThread, pyqtSignal
+import config
+import image_processing
+import mcu_side
+
+# Per-site timing columns, in seconds
+TIMING_FIELDS = ["site", "x", "y", "move", "settle", "idle", "expose", "prepare"]
+DISPLAY_TIMEOUT = 5.0  # Seconds the GUI gets to put a site's frame on the DLP before the job is aborted
+
+
+def load_sites(csv_path, photo, align, exposure):
+    """Read a site list CSV into dicts (x, y, photo, align, exposure), filling gaps with the defaults"""
+    sites = []
+    with open(csv_path, newline="") as f:
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            try:
+                sites.append({
+                    "x": int(row["x"]),
+                    "y": int(row["y"]),
+                    "photo": row.get("photo") or photo,
+                    "align": row.get("align") or align,
+                    "exposure": float(row.get("exposure") or exposure),
+                })
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError(f"{csv_path} line {line}: {e}")
+    return sites
+
+
+def grid_sites(columns, rows, pitch_x, pitch_y, photo, align, exposure, origin=(0, 0)):
+    """Site list for a simple rectangular grid (pitch in steps), row by row"""
+    return [{"x": origin[0] + column * pitch_x, "y": origin[1] + row * pitch_y,
+             "photo": photo, "align": align, "exposure": exposure}
+            for row in range(rows) for column in range(columns)]
+
+
+class StepRepeatJob(QThread):
+    """Runs a site list: move, settle, expose, with the next frame prepared during the move"""
+
+    positionChanged = pyqtSignal(int, int)  # Stage position after a move (steps)
+    exposeFrame = pyqtSignal(int, object)  # (site number, RGB frame) - show it, then call frame_displayed()
+    blackout = pyqtSignal(int)  # Site number whose exposure just ended
+    siteDone = pyqtSignal(dict)  # Timing of one site (TIMING_FIELDS)
+    jobDone = pyqtSignal(bool)  # True if every site was exposed
+
+    def __init__(self, sites, start_position=(0, 0), settle_time=None, move=None, parent=None):
+        super().__init__(parent)
+        self.sites = sites
+        self.position = list(start_position)
+        self.settle_time = config.STAGE_SETTLE_TIME if settle_time is None else settle_time
+        self.move = move if move is not None else mcu_side.move_motor
+        # Settings are read now, so changing a slider mid-job doesn't change later sites
+        self.brightness = (config.BRIGHTNESS_UV, config.BRIGHTNESS_RED, config.BRIGHTNESS_GREEN)
+        self.size = (config.LITHO_SIZE_PX_X, config.LITHO_SIZE_PX_Y)
+        self.timings = []
+        self._stop = threading.Event()
+        self._displayed = threading.Event()
+
+    def stop(self):
+        """Stop after the current step (the running exposure is cut short)"""
+        self._stop.set()
+        self._displayed.set()
+
+    def frame_displayed(self):
+        """Called by the GUI once the frame from exposeFrame is on the DLP; the exposure clock starts now"""
+        self._displayed.set()
+
+    def stopped(self):
+        return self._stop.is_set() or getattr(mcu_side, "E_STOP_ACTIVE", False)
+
+    def _prepare(self, site):
+        # Runs on the prep thread
+        start = time.perf_counter()
+        frame = image_processing.composite_frame(site["photo"], site["align"], *self.brightness, self.size)
+        return frame, time.perf_counter() - start
+
+    def _move_to(self, x, y):
+        """Move to (x, y); False if the job was stopped or the E-stop blocked or cut short a move"""
+        for axis, index, target in (("X", 0, x), ("Y", 1, y)):
+            if self.stopped():
+                return False
+            delta = target - self.position[index]
+            if delta:
+                self.move(axis, "+" if delta > 0 else "-", abs(delta))
+                # move_motor returns early without saying so when the E-stop is (or goes) active
+                if getattr(mcu_side, "E_STOP_ACTIVE", False):
+                    return False
+                self.position[index] = target
+                self.positionChanged.emit(*self.position)
+        return True
+
+    def run(self):
+        completed = True
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="StepRepeatPrep") as prep:
+            next_frame = prep.submit(self._prepare, self.sites[0]) if self.sites else None
+            for number, site in enumerate(self.sites):
+                if self.stopped():
+                    completed = False
+                    break
+                frame_future = next_frame
+                # Start on the next site's frame now, it has the whole move + exposure to finish
+                next_frame = prep.submit(self._prepare, self.sites[number + 1]) if number + 1 < len(self.sites) else None
+
+                start = time.perf_counter()
+                if not self._move_to(site["x"], site["y"]):
+                    if getattr(mcu_side, "E_STOP_ACTIVE", False):
+                        print(f"Step and repeat: E-stop during the move to site {number + 1}, the stage may not have "
+                              f"reached ({site['x']}, {site['y']}); last known position {tuple(self.position)}. Job aborted.")
+                    completed = False
+                    break
+                moved = time.perf_counter()
+                self._stop.wait(self.settle_time)
+                settled = time.perf_counter()
+                try:
+                    frame, prepare_time = frame_future.result()
+                except Exception as e:
+                    print(f"Step and repeat: could not prepare site {number + 1}: {e}")
+                    completed = False
+                    break
+                ready = time.perf_counter()
+                if self.stopped():
+                    completed = False
+                    break
+
+                # Expose. The clock starts once the GUI has put the frame on the DLP.
+                self._displayed.clear()
+                self.exposeFrame.emit(number, frame)
+                if not self._displayed.wait(DISPLAY_TIMEOUT):
+                    print(f"Step and repeat: site {number + 1} was not displayed within {DISPLAY_TIMEOUT} s. Job aborted.")
+                    self._stop.set() # So the GUI ignores the exposeFrame if it still gets to it
+                    self.blackout.emit(number)
+                    completed = False
+                    break
+                if self.stopped():
+                    self.blackout.emit(number)
+                    completed = False
+                    break
+                exposure_start = time.perf_counter()
+                self._stop.wait(site["exposure"])
+                self.blackout.emit(number)
+                done = time.perf_counter()
+
+                timing = {"site": number + 1, "x": site["x"], "y": site["y"],
+                          "move": moved - start, "settle": settled - moved, "idle": ready - settled,
+                          "expose": done - exposure_start, "prepare": prepare_time}
+                self.timings.append(timing)
+                self.siteDone.emit(timing)
+            if next_frame is not None:
+                next_frame.cancel()
+        if self.stopped():
+            completed = False
+        print(self.summary())
+        self.jobDone.emit(completed)
+
+    def summary(self):
+        if not self.timings:
+            return "Step and repeat: no sites exposed"
+        totals = {field: sum(t[field] for t in self.timings) for field in ("move", "settle", "idle", "expose", "prepare")}
+        sites = len(self.timings)
+        lines = [f"Step and repeat: {sites} of {len(self.sites)} sites exposed"]
+        for field, total in totals.items():
+            lines.append(f"  {field:8s} total {total:8.2f} s, mean {total / sites * 1000:8.1f} ms")
+        return "\n".join(lines)
+
+    def save_report(self, path):
+        """Per-site timings as CSV (seconds)"""
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=TIMING_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.timings)
@@ -0,0 +1,65 @@
+# Timing for distortion.py: building the remap tables, loading them back from the disk
+# cache, and correcting a frame, at 1080p and 4K - with cv2.remap and with the numpy
+# fallback. Also checks that an identity calibration leaves frames untouched.
+#
+# Run from this folder:  python bench_distortion.py
+
+import json
+import os
+import tempfile
+import time
+import numpy as np
+import config
+import distortion
+
+SIZES = [(1920, 1080), (3840, 2160)]
+REPEATS = 5
+CALIBRATION = {"homography": [[1.0, 0.02, 0.0], [0.01, 1.0, 0.0], [0.0, 0.03, 1.0]], "k1": -0.05, "k2": 0.01}
+
+def best_time(function, *args):
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - start)
+    return result, min(times)
+
+def main():
+    rng = np.random.default_rng(0)
+    folder = tempfile.mkdtemp()
+    config.DISTORTION_CACHE_FOLDER = os.path.join(folder, "cache")
+    calibration_path = os.path.join(folder, "calibration.json")
+    identity_path = os.path.join(folder, "identity.json")
+    with open(calibration_path, "w") as f:
+        json.dump(CALIBRATION, f)
+    with open(identity_path, "w") as f:
+        json.dump({}, f)
+    opencv = distortion.cv2
+    print(f"OpenCV: {opencv.__version__ if opencv is not None else 'not installed'}")
+    print(f"{'size':>10s} {'build':>8s} {'disk load':>9s} {'prepare':>8s} {'nearest':>8s} {'linear':>8s} {'numpy':>8s}  identity unchanged")
+    for size in SIZES:
+        frame = rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+        start = time.perf_counter()
+        maps = distortion.load_maps(calibration_path, size)  # Not cached yet
+        build = time.perf_counter() - start
+        maps, disk = best_time(distortion.load_maps, calibration_path, size)
+        nearest, prepare = best_time(distortion.Remap, *maps, "nearest")
+        _, nearest_time = best_time(nearest.apply, frame)
+        linear = distortion.Remap(*maps, "linear")
+        _, linear_time = best_time(linear.apply, frame)
+        distortion.cv2 = None
+        fallback = distortion.Remap(*maps, "nearest")
+        _, numpy_time = best_time(fallback.apply, frame)
+        identity = distortion.Remap(*distortion.load_maps(identity_path, size), "nearest")
+        unchanged = np.array_equal(identity.apply(frame), frame)
+        distortion.cv2 = opencv
+        same = np.array_equal(fallback.apply(frame), nearest.apply(frame)) if opencv is not None else True
+        if opencv is not None:
+            identity = distortion.Remap(*distortion.load_maps(identity_path, size), "nearest")
+            unchanged = unchanged and np.array_equal(identity.apply(frame), frame)
+        print(f"{size[0]:>5d}x{size[1]:<4d} {build * 1000:6.1f}ms {disk * 1000:7.1f}ms {prepare * 1000:6.1f}ms"
+              f" {nearest_time * 1000:6.1f}ms {linear_time * 1000:6.1f}ms {numpy_time * 1000:6.1f}ms  {unchanged}"
+              f"{'' if same else ' (numpy and OpenCV differ)'}")
+
+if __name__ == "__main__":
+    main()
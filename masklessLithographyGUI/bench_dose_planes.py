@@ -0,0 +1,51 @@
+# Timing for dose_planes.py: splitting a greyscale dose map into 8 packed bit planes
+# with the bit-matrix transpose, next to the straightforward way (shift, mask and
+# np.packbits once per plane), at 1080p and 4K. Also checks that the planes add back
+# up to the dose map, and times the whole dose_sequence() (planes -> 1-bit QImages).
+#
+# Run from this folder:  python bench_dose_planes.py
+
+import time
+import numpy as np
+import dose_planes
+
+SIZES = [(1920, 1080), (3840, 2160)]
+REPEATS = 5
+PERIOD = 1 / 60
+
+def best_time(function, *args):
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - start)
+    return result, min(times)
+
+def per_plane(dose):
+    return [np.packbits((dose >> b) & 1, axis=1) for b in range(8)]
+
+def make_dose(size, kind, rng):
+    width, height = size
+    if kind == "random":
+        return rng.integers(0, 256, (height, width), dtype=np.uint8)
+    # Radial ramp, like a microlens dose profile
+    y, x = np.mgrid[0:height, 0:width]
+    radius = np.hypot(x - width / 2, y - height / 2) / (min(size) / 2)
+    return np.clip(255 * (1 - radius ** 2), 0, 255).astype(np.uint8)
+
+def main():
+    rng = np.random.default_rng(0)
+    print(f"{'size':>10s} {'dose':7s} {'transpose':>10s} {'per plane':>10s} {'sequence':>9s}  planes add up")
+    for size in SIZES:
+        for kind in ("random", "ramp"):
+            dose = make_dose(size, kind, rng)
+            planes, transpose_time = best_time(dose_planes.bit_planes, dose)
+            reference, per_plane_time = best_time(per_plane, dose)
+            same = all(np.array_equal(plane.packed, packed) for plane, packed in zip(planes, reference))
+            total = sum(plane.to_array(on=1, off=0).astype(np.uint16) << b for b, plane in enumerate(planes))
+            _, sequence_time = best_time(dose_planes.dose_sequence, dose, 10.0, PERIOD)
+            print(f"{size[0]:>5d}x{size[1]:<4d} {kind:7s} {transpose_time * 1000:8.1f}ms {per_plane_time * 1000:8.1f}ms"
+                  f" {sequence_time * 1000:7.1f}ms  {same and np.array_equal(total, dose)}")
+
+if __name__ == "__main__":
+    main()
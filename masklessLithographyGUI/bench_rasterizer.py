@@ -0,0 +1,77 @@
+# Timing for rasterizer.py:
+#  1. the SVGs in svg_images, full frame at 768, 1080p and 4K, binary and 4x4 antialiased,
+#     next to QSvgRenderer (svg_raster.render_svg) for comparison
+#  2. a generated "device layout" of many small polygons, cut into 1080p tiles,
+#     with and without the PolygonIndex (the index should make tiles much cheaper)
+#
+# Run from this folder:  python bench_rasterizer.py
+
+import os
+import time
+import numpy as np
+from PyQt5.QtWidgets import QApplication
+import rasterizer
+import svg_raster
+
+SIZES = [(768, 768), (1920, 1080), (3840, 2160)]
+LAYOUT_SIZE = (20_000, 20_000)
+LAYOUT_CELLS = 100  # LAYOUT_CELLS x LAYOUT_CELLS pads plus one trace each
+TILE = (1920, 1080)
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def bench_svgs():
+    print("SVG files (ms)            size        shapes  parse  binary  aa 4x4  Qt render  px differing from Qt")
+    for name in sorted(os.listdir("svg_images")):
+        path = os.path.join("svg_images", name)
+        for size in SIZES:
+            shapes, t_parse = timed(rasterizer.load_svg, path, size)
+            mask, t_binary = timed(rasterizer.rasterize, shapes, 0, 0, size[0], size[1])
+            _, t_aa = timed(rasterizer.rasterize, shapes, 0, 0, size[0], size[1], antialias=4)
+            qt, t_qt = timed(svg_raster.render_svg, path, size)
+            # Qt draws the shapes dark on white, the rasterizer marks them as UV (on)
+            differing = int(np.count_nonzero((mask.to_array() > 0) == (qt[..., 0] > 0)))
+            print(f"  {name[:24]:24s} {size[0]:5d}x{size[1]:<5d} {len(shapes):5d}  {t_parse * 1000:5.0f}  {t_binary * 1000:6.0f}"
+                  f"  {t_aa * 1000:6.0f}  {t_qt * 1000:9.0f}  {differing}")
+
+def make_layout():
+    # A grid of square pads, each with an L-shaped trace, spread over LAYOUT_SIZE
+    shapes = []
+    pitch = LAYOUT_SIZE[0] / LAYOUT_CELLS
+    for row in range(LAYOUT_CELLS):
+        for column in range(LAYOUT_CELLS):
+            x, y = column * pitch + 10, row * pitch + 10
+            shapes.append(rasterizer.Shape([[[x, y], [x + 60, y], [x + 60, y + 60], [x, y + 60]]]))
+            shapes.append(rasterizer.Shape([[[x + 60, y + 25], [x + 150, y + 25], [x + 150, y + 140],
+                                             [x + 140, y + 140], [x + 140, y + 35], [x + 60, y + 35]]]))
+    return shapes
+
+def bench_layout():
+    shapes, t_make = timed(make_layout)
+    print(f"\nLayout: {len(shapes)} shapes over {LAYOUT_SIZE[0]} x {LAYOUT_SIZE[1]} px, {TILE[0]}x{TILE[1]} tiles")
+    source, t_index = timed(rasterizer.PolygonMaskSource, shapes, LAYOUT_SIZE[0], LAYOUT_SIZE[1], tile_size=TILE)
+    print(f"  index built in {t_index * 1000:.0f} ms, {len(source)} tiles")
+
+    start = time.perf_counter()
+    lit = 0
+    for column, row, tile in source:
+        lit += tile.count()
+    t_indexed = time.perf_counter() - start
+    print(f"  with index:    {t_indexed:.2f} s ({t_indexed / len(source) * 1000:.1f} ms per tile), {lit} px on")
+
+    # Same tiles, but every tile gets the full shape list (only the bounding box checks skip shapes)
+    count = min(len(source), 20)
+    start = time.perf_counter()
+    for number in range(count):
+        x0, y0 = source.tile_origin(number % source.columns, number // source.columns)
+        rasterizer.rasterize(shapes, x0, y0, TILE[0], TILE[1])
+    t_plain = (time.perf_counter() - start) / count
+    print(f"  without index: {t_plain * 1000:.1f} ms per tile (first {count} tiles)")
+
+if __name__ == "__main__":
+    app = QApplication([])  # QSvgRenderer/QPainter need an application object
+    bench_svgs()
+    bench_layout()
@@ -0,0 +1,52 @@
+# Benchmark and edge-fidelity check for the layer resampling modes in image_processing.
+# Run from this folder:  python bench_resample.py
+#
+# For every mask in png_images and a few target sizes, this prints:
+#   - time per resize
+#   - grey %: pixels that are neither 0 nor 255 (a binary mask should have none)
+#   - edge err %: pixels that differ from an area-averaged reference thresholded at 50%,
+#     i.e. how far the hard edges moved compared to the "ideal" binary downsample
+# It also checks that "exact" (PIL nearest neighbour) is a true pixel repeat / block-centre
+# sample for integer scale factors, i.e. lossless after an enlarge + shrink.
+
+import os
+import time
+import numpy as np
+from PIL import Image
+from image_processing import resize_layer, is_binary
+
+IMAGE_FOLDER = "png_images"
+SIZES = [(768, 768), (1920, 1080), (3840, 2160)]  # (width, height)
+MODES = ["exact", "nearest", "bicubic", "area", "lanczos"]
+REPEATS = 3
+
+def best_time(func):
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def main():
+    for name in sorted(os.listdir(IMAGE_FOLDER)):
+        img = Image.open(os.path.join(IMAGE_FOLDER, name)).convert("RGB")
+        print(f"\n{name}  {img.size[0]} x {img.size[1]}  binary: {is_binary(img)}")
+
+        # "exact" must be a pixel repeat when enlarging, and give back the original after shrinking again
+        src = np.asarray(img)
+        up = resize_layer(img, (img.size[0] * 3, img.size[1] * 3), "exact")
+        assert np.array_equal(up, src.repeat(3, axis=0).repeat(3, axis=1)), "exact enlarge is not a pixel repeat"
+        assert np.array_equal(resize_layer(Image.fromarray(up), img.size, "exact"), src), "exact resize is not lossless"
+
+        # Plus an integer factor
+        for size in SIZES + [(img.size[0] // 2, img.size[1] // 2)]:
+            reference = np.where(resize_layer(img, size, "area") >= 128, 255, 0)
+            for mode in MODES:
+                seconds, arr = best_time(lambda: resize_layer(img, size, mode))
+                grey = np.count_nonzero((arr != 0) & (arr != 255)) / arr.size
+                edge_err = np.count_nonzero(arr != reference) / arr.size
+                print(f"  {size[0]:>4} x {size[1]:<4}  {mode:<8} {seconds*1000:8.1f} ms   grey: {grey*100:6.3f} %   edge err: {edge_err*100:6.3f} %")
+
+if __name__ == "__main__":
+    main()
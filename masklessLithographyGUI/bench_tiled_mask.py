@@ -0,0 +1,72 @@
+# Peak memory check for TiledMaskSource: walks every DLP tile of generated designs
+# from 10k x 10k up to 50k x 50k pixels and reports the peak resident memory (RSS).
+# RSS should stay roughly flat as the design grows, since only one tile is held at a time.
+#
+# Run from this folder:  python bench_tiled_mask.py [folder for the test files]
+# (The 50k design is ~300 MB on disk; files are deleted afterwards.)
+# Peak RSS is read from /proc (Linux), or the resource module elsewhere (not on Windows).
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+SIZES = [10_000, 20_000, 30_000, 40_000, 50_000]
+TILE = (1920, 1080)
+OVERLAP = 32
+STRIP_ROWS = 256
+
+def make_design(path, size):
+    # Diagonal stripes, generated strip by strip so the generator itself stays small
+    from tiled_mask import write_bitplane
+    x = np.arange(size, dtype=np.int32)
+    def strips():
+        for y0 in range(0, size, STRIP_ROWS):
+            y = np.arange(y0, min(y0 + STRIP_ROWS, size), dtype=np.int32)[:, None]
+            yield ((x[None, :] + y) // 64) % 2 == 0
+    write_bitplane(path, size, size, strips())
+
+def peak_rss_kb():
+    # VmHWM is reset when a new program starts; ru_maxrss on Linux carries over the parent's peak
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # macOS reports bytes
+
+def walk(path):
+    # Runs in a fresh process so the peak only covers this one design
+    from tiled_mask import TiledMaskSource
+    start = time.perf_counter()
+    lit = 0
+    with TiledMaskSource(path, TILE, OVERLAP) as source:
+        for _, _, tile in source:
+            lit += tile.count()
+        tiles = len(source)
+    seconds = time.perf_counter() - start
+    peak_kb = peak_rss_kb()
+    print(f"{tiles} {seconds} {peak_kb} {lit}")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--walk":
+        walk(sys.argv[2])
+        sys.exit(0)
+
+    folder = sys.argv[1] if len(sys.argv) > 1 else tempfile.gettempdir()
+    print(f"Tile {TILE[0]} x {TILE[1]}, overlap {OVERLAP} px")
+    for size in SIZES:
+        path = os.path.join(folder, f"bench_design_{size}.bits")
+        make_design(path, size)
+        try:
+            result = subprocess.run([sys.executable, __file__, "--walk", path], capture_output=True, text=True, check=True)
+        finally:
+            os.remove(path)
+        tiles, seconds, peak_kb, lit = result.stdout.split()
+        print(f"{size:>6} x {size:<6} {int(tiles):>5} tiles  {float(seconds):6.2f} s   peak RSS: {int(peak_kb) / 1024:7.1f} MB")
@@ -6,14 +6,50 @@
 # 
 # Thanks to Google and 'eyllanesc' on stack overflow
 
+# The capture thread only ever keeps the newest frame (FrameMailbox, a single slot): the GUI
+# pulls it on a timer at its own pace (config.CAMERA_POLL_MS), so a slow or busy GUI never
+# builds up a queue of old frames - it just skips to the latest one. Frames that were
+# replaced before the GUI got to them are counted as dropped, see CameraFeed.stats().
+
 from PyQt5.QtWidgets import  QWidget, QLabel, QApplication
-from PyQt5.QtCore import QThread, Qt, pyqtSignal, pyqtSlot
+from PyQt5.QtCore import QThread, QTimer, pyqtSlot
 from PyQt5.QtGui import QImage, QPixmap
 import sys
+import threading
 import cv2
+import config
+
+FEED_SIZE = (640, 480)  # Frames are scaled to fit this, keeping the aspect ratio
+RETRY_DELAY = 0.05  # Seconds between reads after a failed one (no busy loop while the camera is gone)
+
+class FrameMailbox:
+    # Holds the latest frame only. put() from the capture thread, take() from the GUI.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._frame = None
+        self.captured = 0  # Frames put in
+        self.displayed = 0  # Frames taken out
+        self.dropped = 0  # Frames replaced before anyone took them
+
+    def put(self, frame):
+        with self._lock:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = frame
+            self.captured += 1
+
+    def take(self):
+        # The newest frame, or None if there's nothing new since the last take()
+        with self._lock:
+            frame, self._frame = self._frame, None
+            if frame is not None:
+                self.displayed += 1
+            return frame
 
 class Thread(QThread):
-    updatePixmap = pyqtSignal(QImage)
+    def __init__(self, mailbox, parent=None):
+        super().__init__(parent)
+        self.mailbox = mailbox
 
     def run(self):
         # Try to open the basler camera
@@ -26,32 +62,55 @@ class Thread(QThread):
             print(f"Exception: {e}")
             print("No camera found.")
             return
-        # Continuously get frames from the camera
-        while True:
+        if not cap.isOpened():
+            print("No camera found.")
+            return
+        # Get frames until the feed is stopped. cap.read() waits for the next frame.
+        while not self.isInterruptionRequested():
             ret, frame = cap.read()
-            if ret:
-                # https://stackoverflow.com/a/55468544/6622587
-                rgbImage = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                h, w, ch = rgbImage.shape
-                bytesPerLine = ch * w
-                convertToQtFormat = QImage(rgbImage.data, w, h, bytesPerLine, QImage.Format_RGB888)
-                p = convertToQtFormat.scaled(640, 480, Qt.KeepAspectRatio)
-                self.updatePixmap.emit(p)
+            if not ret:
+                self.msleep(int(RETRY_DELAY * 1000))
+                continue
+            # Scale and convert here, off the GUI thread
+            h, w = frame.shape[:2]
+            scale = min(FEED_SIZE[0] / w, FEED_SIZE[1] / h)
+            frame = cv2.resize(frame, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+            # https://stackoverflow.com/a/55468544/6622587
+            self.mailbox.put(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        cap.release()
 
 class CameraFeed(QWidget):
     def __init__(self):
         super().__init__()
         # Make a label to hold the camera feed
         self.label = QLabel(self)
-        self.label.resize(640, 480)
-        # Use threading to continuously update the camera
-        th = Thread(self)
-        th.updatePixmap.connect(self.setImage)
-        th.start()
+        self.label.resize(*FEED_SIZE)
+        # The camera is read on its own thread; the newest frame is picked up on a timer
+        self.mailbox = FrameMailbox()
+        self.capture_thread = Thread(self.mailbox, self)
+        self.capture_thread.start()
+        self.poll_timer = QTimer(self)
+        self.poll_timer.timeout.connect(self.showLatest)
+        self.poll_timer.start(config.CAMERA_POLL_MS)
         self.show()
-    @pyqtSlot(QImage)
-    def setImage(self, image):
-        self.label.setPixmap(QPixmap.fromImage(image))
+
+    @pyqtSlot()
+    def showLatest(self):
+        rgbImage = self.mailbox.take()
+        if rgbImage is None:
+            return # No new frame since the last one
+        h, w, ch = rgbImage.shape
+        image = QImage(rgbImage.data, w, h, ch * w, QImage.Format_RGB888)
+        self.label.setPixmap(QPixmap.fromImage(image)) # fromImage copies, rgbImage may go
+
+    def stats(self):
+        # (captured, displayed, dropped) frame counts
+        return (self.mailbox.captured, self.mailbox.displayed, self.mailbox.dropped)
+
+    def stop(self):
+        self.poll_timer.stop()
+        self.capture_thread.requestInterruption()
+        self.capture_thread.wait(1000)
 
 # app = QApplication(sys.argv)
 # camFeed = CameraFeed()
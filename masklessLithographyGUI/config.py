@@ -12,3 +12,29 @@ EXPOSURE_TIME = 15.0  # Default exposure time in seconds
 BRIGHTNESS_UV = 128  # Default UV LED brightness (0-255)
 BRIGHTNESS_RED = 128  # Default Red LED brightness (0-255)
 BRIGHTNESS_GREEN = 0  # Default Green LED brightness (0-255)
+
+RESAMPLE_MODE = "auto"  # How images are fitted to the lithography size: "auto", "exact", "nearest", "bicubic", "area" or "lanczos" (see image_processing.py)
+
+LAYER_CACHE_MB = 512  # Memory budget for decoded/resized image layers kept between preview updates
+FRAME_CACHE_MB = 256  # Memory budget for finished preview frames (for switching back to a previous mask/brightness)
+PLANE_CACHE_MB = 256  # Memory budget for per-channel brightness planes (recomputed only when their layer/brightness changes)
+
+LIVE_PREVIEW = True  # Recomposite the preview while brightness sliders are dragged (throttled to the display refresh rate)
+CAMERA_POLL_MS = 16  # How often the camera feed picks up the newest frame (see camera.py)
+
+SVG_CACHE_FOLDER = "svg_cache"  # SVG masks rendered at the DLP resolution (see svg_raster.py)
+SVG_ANTIALIAS = False  # False renders SVGs pure black/white, True keeps grey edge pixels
+
+FLAT_FIELD_MAP = ""  # uint8 UV gain map (.npy or .png) evening out the field's intensity, "" = off (see flat_field.py)
+
+DISTORTION_CALIBRATION = ""  # JSON calibration of the projection optics to pre-warp frames with, "" = off (see distortion.py)
+DISTORTION_INTERPOLATION = "nearest"  # "nearest" keeps masks black/white, "linear" is smoother for greyscale
+DISTORTION_CACHE_FOLDER = "distortion_cache"  # Remap tables built per calibration and resolution
+
+EXPOSURE_LOG = "exposure_log.csv"  # Target vs measured on-time of every timed exposure (see exposure_timer.py)
+DLP_REFRESH_HZ = 0  # DLP refresh rate for frame sequences (see frame_sequence.py); 0 = ask the display
+
+JOB_FOLDER = "jobs"  # Where precompiled exposure jobs (.egenjob bundles) are saved
+
+SAVE_SNAPSHOT = True  # Save every composited frame to SNAPSHOT_FILE (written in the background)
+SNAPSHOT_FILE = "blended_image.png"
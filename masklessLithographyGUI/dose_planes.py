@@ -0,0 +1,102 @@
+# Greyscale lithography: expose a dose map as a sequence of black/white bit planes.
+#
+# The DLP frame is a single static image, so a pixel gets either the full UV dose for the
+# exposure time or nothing (grey blue values just change the LED duty, not reliably the dose).
+# Instead, a greyscale dose map (0 = no dose, 255 = full dose) is split into its bits:
+#   plane b is on wherever bit b of the dose is set, and is shown for 2^b time units.
+# Summed over the planes every pixel gets exactly dose / 255 of the full exposure.
+#
+# The split is done for all planes at once with a bit-matrix transpose: every 8 neighbouring
+# pixels are 8 bytes = one uint64, i.e. an 8x8 bit matrix (pixels x bits). Transposing it
+# (three masked shift/xor steps, Hacker's Delight 7-3) turns it into 8 bytes that each hold one
+# bit of all 8 pixels - which is exactly a byte of each plane's np.packbits row. So the planes
+# come out already packed as BitMasks, in a handful of whole-array numpy operations.
+#
+# Every plane has to be on screen for a whole number of display refreshes, so each plane's
+# time is rounded to refresh periods (at most half a period off per plane, so under 4 periods
+# for any pixel), and low bits are dropped if the full exposure is too short for the smallest
+# plane to get one refresh (max_bits()). dose_sequence() returns frames and durations ready
+# for frame_sequence.FrameSequence.
+
+import numpy as np
+from PyQt5.QtGui import QImage, qRgb
+from bitmask import BitMask
+
+MAX_BITS = 8
+
+# Masks and shifts of the 8x8 bit-matrix transpose
+_TRANSPOSE_STEPS = [(np.uint64(0x00AA00AA00AA00AA), np.uint64(7)),
+                    (np.uint64(0x0000CCCC0000CCCC), np.uint64(14)),
+                    (np.uint64(0x00000000F0F0F0F0), np.uint64(28))]
+
+
+def quantize(dose, bits):
+    """Map a 0-255 dose map onto 0 .. 2^bits - 1 levels (rounded)"""
+    if bits == MAX_BITS:
+        return dose
+    levels = (1 << bits) - 1
+    lut = ((np.arange(256, dtype=np.uint32) * levels + 127) // 255).astype(np.uint8)
+    return np.take(lut, dose)
+
+
+def bit_planes(dose, bits=MAX_BITS):
+    """BitMasks of a 2D uint8 dose map, least significant first: planes[b] is on where the dose has bit b set"""
+    if dose.dtype != np.uint8 or dose.ndim != 2:
+        raise ValueError(f"Expected a 2D uint8 dose map, got {dose.dtype} {dose.shape}")
+    if not 1 <= bits <= MAX_BITS:
+        raise ValueError(f"bits must be 1 to {MAX_BITS}, got {bits}")
+    height, width = dose.shape
+    dose = quantize(dose, bits)
+    padded = (width + 7) // 8 * 8
+    if padded != width:
+        dose = np.pad(dose, ((0, 0), (0, padded - width)))  # Same zero padding packbits uses
+    # Big-endian, so the first of every 8 pixels is the top byte (= the top row of the bit matrix)
+    x = np.ascontiguousarray(dose).view(">u8").astype(np.uint64)
+    t = np.empty_like(x)
+    for mask, shift in _TRANSPOSE_STEPS:
+        np.right_shift(x, shift, out=t)
+        t ^= x
+        t &= mask
+        x ^= t
+        t <<= shift
+        x ^= t
+    # Byte b of every word is now 8 pixels of plane b, most significant pixel first
+    planes = x.view(np.uint8).reshape(height, padded // 8, 8)
+    return [BitMask(np.ascontiguousarray(planes[..., b]), width) for b in range(bits)]
+
+
+def max_bits(full_time, period):
+    """Most bits a full dose of `full_time` seconds can hold, with the smallest plane on for at least one refresh"""
+    for bits in range(MAX_BITS, 0, -1):
+        if full_time / ((1 << bits) - 1) >= period * 0.999:
+            return bits
+    return 1
+
+
+def plane_durations(full_time, bits, period):
+    """Display time of each plane (least significant first): its share of `full_time`, in whole refresh periods"""
+    unit = full_time / ((1 << bits) - 1)
+    return [max(1, round(unit * (1 << b) / period)) * period for b in range(bits)]
+
+
+def plane_image(mask, uv=255):
+    """A bit plane as a 1-bit QImage: on pixels are UV (blue) at brightness `uv`, off pixels black"""
+    image = QImage(mask.packed.data, mask.width, mask.height, mask.packed.shape[1], QImage.Format_Mono)
+    image.setColorTable([qRgb(0, 0, 0), qRgb(0, 0, uv)])
+    return image.copy()  # Own the pixels, the numpy buffer may go away
+
+
+def dose_sequence(dose, full_time, period, bits=None, uv=255):
+    """Frames (QImages) and durations (s) that give `dose` / 255 of `full_time` to every pixel.
+
+    bits=None uses as many as the refresh period allows. Planes that are off everywhere are
+    left out (they would only add dark time). Returns (frames, durations, bits).
+    """
+    if bits is None:
+        bits = max_bits(full_time, period)
+    frames, durations = [], []
+    for mask, duration in zip(bit_planes(dose, bits), plane_durations(full_time, bits, period)):
+        if mask.packed.any():
+            frames.append(plane_image(mask, uv))
+            durations.append(duration)
+    return frames, durations, bits
@@ -0,0 +1,180 @@
+# Multi-frame exposures: a list of frames, each shown for its own duration, back to back.
+#
+# Used for sequential patterns and for time-multiplexed grey levels (bit planes), where
+# every frame's on-time matters. So:
+#   - All frames are turned into QPixmaps in load(), before anything is shown. During playback
+#     a frame change is just swapping the pixmap on the DLP's FrameBlitter and repainting it.
+#   - The schedule is locked to the display refresh: durations are rounded to whole refresh
+#     periods (config.DLP_REFRESH_HZ, or what the screen reports), and frame i goes up at
+#     first frame + (sum of the earlier durations). Each frame is painted (repaint(), which
+#     flushes to the window) on its tick, timed like exposure_timer: a PreciseTimer wakes up
+#     SPIN_MARGIN early and busy-waits the rest. Painting a frame takes a few ms, so like the
+#     exposure timer's blackout it is started that much (paint_latency, a running average) early.
+#     Qt widgets don't report the actual buffer swaps, so the refresh grid starts at the first
+#     frame's paint rather than a real vblank; the compositor puts each paint on the next vblank.
+#   - While playing, the DLPSurfaces are held (see dlp_output.py), so preview updates can't paint
+#     over a frame; the newest preview frame goes back on the exposure page at the end.
+#   - Every frame is accounted for: presented (painted on time), late (painted more than
+#     LATE_TOLERANCE of a refresh period after its tick) or dropped (its whole slot had
+#     already passed, so it was skipped to keep the rest of the sequence on schedule).
+
+import time
+from PyQt5.QtCore import QObject, QTimer, Qt, pyqtSignal
+from PyQt5.QtGui import QGuiApplication, QImage, QPixmap
+import config
+import image_processing
+from exposure_timer import PaintClock, SPIN_MARGIN, LATENCY_SMOOTHING
+
+LATE_TOLERANCE = 0.5  # Fraction of a refresh period a frame may be painted after its tick
+
+
+def refresh_rate(widget=None):
+    """Refresh rate (Hz) of the screen showing `widget`; config.DLP_REFRESH_HZ overrides it"""
+    if config.DLP_REFRESH_HZ:
+        return float(config.DLP_REFRESH_HZ)
+    handle = widget.window().windowHandle() if widget is not None else None
+    screen = handle.screen() if handle is not None else QGuiApplication.primaryScreen()
+    rate = screen.refreshRate() if screen is not None else 0
+    return rate if rate > 0 else 60.0
+
+
+class FrameSequence(QObject):
+    """Plays preloaded frames on DLPSurfaces with per-frame durations, then blacks out"""
+
+    frameShown = pyqtSignal(int)  # Index of the frame just painted
+    finished = pyqtSignal(dict)  # Playback statistics, see stats()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.clock = PaintClock(self)
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self._wake)
+        self.pixmaps = []
+        self.durations = []  # Requested, in seconds
+        self.ticks = []  # Duration of each frame in refresh periods
+        self.period = None
+        self.paint_latency = 0.0  # Seconds from starting a frame change to it being painted
+        self._surfaces = None
+        self._due = None  # Tick time of each frame, plus the end of the sequence
+        self._next = 0
+        self._presented = []
+        self._ended_at = None
+        self._aborted = False
+
+    def active(self):
+        return self._surfaces is not None
+
+    def load(self, frames, durations, surfaces=None):
+        """Upload the frames (RGB numpy frames, QImages or QPixmaps) and set their durations in seconds.
+
+        `durations` is one number per frame, or a single number for all of them.
+        """
+        frames = list(frames)
+        if not isinstance(durations, (list, tuple)):
+            durations = [durations] * len(frames)
+        if len(durations) != len(frames):
+            raise ValueError(f"{len(frames)} frames but {len(durations)} durations")
+        if surfaces is not None:
+            # Already marked for the DLP screen's scale factor, so set_frame() never has to copy one
+            self.pixmaps = [surfaces.exposure_page.prepare(frame) for frame in frames]
+        else:
+            self.pixmaps = [self._to_pixmap(frame) for frame in frames]
+        self.period = 1.0 / refresh_rate(surfaces)
+        # At least one refresh each; a frame can't be shown for less than that
+        self.ticks = [max(1, round(duration / self.period)) for duration in durations]
+        self.durations = list(durations)
+
+    def _to_pixmap(self, frame):
+        if isinstance(frame, QPixmap):
+            return frame
+        if isinstance(frame, QImage):
+            return QPixmap.fromImage(frame)
+        return image_processing.frame_to_pixmap(frame)
+
+    def total_time(self):
+        """Seconds the loaded sequence takes, after rounding to refresh periods"""
+        return sum(self.ticks) * self.period if self.period else 0.0
+
+    def play(self, surfaces):
+        if self.active():
+            self.stop()
+        if not self.pixmaps:
+            print("Frame sequence: nothing loaded")
+            return
+        self._surfaces = surfaces
+        surfaces.hold() # The preview's frame is put back afterwards, it's the single-exposure frame
+        self._presented = [None] * len(self.pixmaps)  # Paint time of each frame (None if dropped)
+        self._aborted = False
+        self._ended_at = None
+        # The first frame sets the grid; the rest follow at whole refresh periods from it
+        surfaces.exposure_page.set_frame(self.pixmaps[0], update=False)
+        shown_at = self.clock.paint_now(surfaces.show_exposure())
+        start = shown_at if shown_at is not None else time.perf_counter()
+        self._due = [start]
+        for ticks in self.ticks:
+            self._due.append(self._due[-1] + ticks * self.period)
+        self._presented[0] = shown_at
+        self.frameShown.emit(0)
+        self._next = 1
+        self._schedule()
+
+    def stop(self):
+        """Black out now (STOP button); the rest of the sequence is counted as dropped"""
+        if self.active():
+            self.timer.stop()
+            self._aborted = True
+            self._end()
+
+    def _schedule(self):
+        wait = self._due[self._next] - self.paint_latency - time.perf_counter() - SPIN_MARGIN
+        self.timer.start(max(0, int(wait * 1000)))
+
+    def _wake(self):
+        start = self._due[self._next] - self.paint_latency
+        while time.perf_counter() < start:
+            pass
+        now = time.perf_counter()
+        # Skip frames whose whole slot has already gone by
+        while self._next < len(self.pixmaps) and now >= self._due[self._next + 1]:
+            self._next += 1
+        if self._next == len(self.pixmaps):
+            self._end()
+            return
+        index = self._next
+        self._surfaces.exposure_page.set_frame(self.pixmaps[index], update=False)
+        self._presented[index] = self.clock.paint_now(self._surfaces.exposure_page)
+        if self._presented[index] is not None:
+            self.paint_latency += LATENCY_SMOOTHING * (self._presented[index] - now - self.paint_latency)
+        self.frameShown.emit(index)
+        self._next += 1
+        self._schedule()
+
+    def _end(self):
+        surfaces, self._surfaces = self._surfaces, None
+        self._ended_at = self.clock.paint_now(surfaces.show_blackout())
+        surfaces.release(update=False)
+        result = self.stats()
+        print(f"Frame sequence {'stopped' if self._aborted else 'done'}: {result['presented']} of {result['frames']} frames presented, "
+              f"{result['late']} late, {result['dropped']} dropped, {result['measured_s']:.4f} s of {result['target_s']:.4f} s")
+        self.finished.emit(result)
+
+    def stats(self):
+        """Counts and timing of the last playback"""
+        late_limit = LATE_TOLERANCE * self.period
+        shown = [(time_shown, due) for time_shown, due in zip(self._presented, self._due) if time_shown is not None]
+        lateness = [time_shown - due for time_shown, due in shown]  # Negative if painted early
+        late = sum(1 for delay in lateness if delay > late_limit)
+        ended = self._ended_at if self._ended_at is not None else time.perf_counter()
+        return {
+            "frames": len(self.pixmaps),
+            "presented": len(shown) - late,
+            "late": late,
+            "dropped": len(self.pixmaps) - len(shown),
+            "worst_late_ms": max(lateness) * 1000 if lateness else None,
+            "refresh_hz": 1.0 / self.period,
+            "target_s": self.total_time(),
+            "measured_s": ended - self._due[0],
+            "aborted": self._aborted,
+        }
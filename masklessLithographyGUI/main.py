@@ -34,7 +34,12 @@ _ Prevent dragging window into DLP or moving mouse onto it... Might get really t
 """
 
 import sys, os
-import config, image_processing, camera
+import config, image_processing, camera, mask_bundle
+from preview_worker import PreviewWorker, FrameRateMeter
+from exposure_timer import ExposureTimer
+from dlp_output import DLPSurfaces
+import frame_sequence, dose_planes
+from frame_sequence import FrameSequence
 import gantryControl as gantry
 from PyQt5.QtWidgets import (
     QApplication, 
@@ -56,13 +61,16 @@ from PyQt5.QtWidgets import (
     QPushButton,
     QSpacerItem,
     QMessageBox,
+    QFileDialog,
     QSizePolicy
 )
 from PyQt5.QtSvg import QGraphicsSvgItem
-from PyQt5.QtCore import Qt, QSize, QRectF
+from PyQt5.QtCore import Qt, QSize, QRectF, QTimer
 from PyQt5.QtGui import QResizeEvent, QBrush, QColor
 
-png_images = os.listdir("png_images")
+# Mask choices: (name shown, path). SVGs are rendered at the DLP resolution, see svg_raster.py
+mask_files = [(name, os.path.join("png_images", name)) for name in os.listdir("png_images")]
+mask_files += [(name, os.path.join("svg_images", name)) for name in os.listdir("svg_images") if name.lower().endswith(".svg")]
 screens = QApplication.screens()
 
 class GraphicsView(QGraphicsView):
@@ -116,6 +124,7 @@ class MainWindow(QMainWindow): # Main GUI for controlling photolithography setti
         self.layout_right = QVBoxLayout()
         self.layout_stage_controller = QGridLayout()
         self.layout_exposure = QHBoxLayout()
+        self.layout_job = QHBoxLayout()
         self.layout_circle = QHBoxLayout()
         self.layout_circle_dia = QVBoxLayout()
         self.layout_circle_offset_x = QVBoxLayout()
@@ -153,7 +162,8 @@ class MainWindow(QMainWindow): # Main GUI for controlling photolithography setti
 
         self.photo_text_file = QLabel(f'Photolithography File: {config.PHOTO_FILE}')
         self.photo_cbox = QComboBox()
-        self.photo_cbox.addItems(png_images)
+        for name, path in mask_files:
+            self.photo_cbox.addItem(name, path)
         self.photo_cbox.setCurrentIndex(1)
 
         self.photo_text_UV = QLabel(f'UV LED Brightness: {config.BRIGHTNESS_UV}')
@@ -168,7 +178,8 @@ class MainWindow(QMainWindow): # Main GUI for controlling photolithography setti
         QLabel.setAlignment(self.assist_text_title, Qt.AlignCenter)
         self.assist_text_file = QLabel(f'Image File: {config.PHOTO_FILE}')
         self.assist_cbox = QComboBox()
-        self.assist_cbox.addItems(png_images)
+        for name, path in mask_files:
+            self.assist_cbox.addItem(name, path)
         self.assist_cbox.setCurrentIndex(1)
 
         # Red and Green LED brightness sliders
@@ -216,10 +227,27 @@ class MainWindow(QMainWindow): # Main GUI for controlling photolithography setti
         self.DLP_preview_scene.addItem(self.photo_and_align_graphics_item)
         self.DLP_preview_view = GraphicsView(self.DLP_preview_scene, self)
 
+        # Later updates are composited in the background and swapped in when ready
+        self.preview_worker = PreviewWorker(self)
+        self.preview_worker.frameReady.connect(self.show_preview_frame)
+        self.preview_worker.failed.connect(lambda request, error: print(f"Preview update failed: {error}"))
+        self.preview_fps = FrameRateMeter()
+
+        # Live preview while dragging sliders: at most one recomposite per display refresh.
+        # Values in between are skipped (the worker only ever computes the newest request).
+        refresh_rate = QApplication.primaryScreen().refreshRate() or 60.0
+        self.live_preview_timer = QTimer(self)
+        self.live_preview_timer.setSingleShot(True)
+        self.live_preview_timer.setTimerType(Qt.PreciseTimer)
+        self.live_preview_timer.setInterval(max(1, round(1000 / refresh_rate)))
+        self.live_preview_timer.timeout.connect(self.live_preview_tick)
+        self.live_preview_dirty = False
+
         
 
         # Output resolution:
         self.resolution_label = QLabel(f"Output resolution: {DLP.width} x {DLP.height}")
+        self.preview_fps_label = QLabel("Preview: -- fps")
         
         # Exposure time
         self.exposure_label = QLabel("Exposure Time:")
@@ -236,6 +264,21 @@ class MainWindow(QMainWindow): # Main GUI for controlling photolithography setti
         self.exposure_STOP.setStyleSheet("background-color: red; color: white; font-weight: bold;")
         self.exposure_START = QPushButton("START")
         self.exposure_START.setStyleSheet("background-color: green; color: white; font-weight: bold;")
+        self.exposure_result_label = QLabel("Exposure time 0 = stays on until STOP")
+
+        # Turns the pattern off after the exposure time and measures how long it was really on
+        self.exposure_timer = ExposureTimer(self)
+        self.exposure_timer.finished.connect(self.exposureFinished)
+
+        # Precompiled jobs (see mask_bundle.py)
+        self.job_compile = QPushButton("Compile Job")
+        self.job_load = QPushButton("Load Job")
+        self.job_play = QPushButton("Play Job") # Every frame of the loaded job, each for the exposure time
+        self.greyscale_START = QPushButton("Greyscale Exposure") # Photo's blue channel as a dose map (see dose_planes.py)
+
+        # Multi-frame exposures (see frame_sequence.py)
+        self.frame_sequence = FrameSequence(self)
+        self.frame_sequence.finished.connect(self.sequenceFinished)
 
         # Alignment SVG layer
         self.alignment_svg_checkbox = QCheckBox("Draw alignment image on wafer")
@@ -271,11 +314,18 @@ class MainWindow(QMainWindow): # Main GUI for controlling photolithography setti
         self.layout_right.addWidget(self.preview_text_title)
         self.layout_right.addWidget(self.DLP_preview_view)
         self.layout_right.addWidget(self.resolution_label)
+        self.layout_right.addWidget(self.preview_fps_label)
         self.layout_exposure.addWidget(self.exposure_label)
         self.layout_exposure.addWidget(self.exposure_spinbox)
         self.layout_exposure.addWidget(self.exposure_STOP)
         self.layout_exposure.addWidget(self.exposure_START)
         self.layout_right.addLayout(self.layout_exposure)
+        self.layout_right.addWidget(self.exposure_result_label)
+        self.layout_job.addWidget(self.job_compile)
+        self.layout_job.addWidget(self.job_load)
+        self.layout_job.addWidget(self.job_play)
+        self.layout_job.addWidget(self.greyscale_START)
+        self.layout_right.addLayout(self.layout_job)
         self.layout_right.addWidget(self.alignment_svg_checkbox)
         self.layout_right.addWidget(self.alignment_circle_checkbox)
         self.layout_right.addWidget(self.alignment_circle_text)
@@ -310,9 +360,18 @@ class MainWindow(QMainWindow): # Main GUI for controlling photolithography setti
         self.photo_slider_UV.valueChanged.connect(lambda: self.photo_text_UV.setText(f'UV LED Brightness: {self.photo_slider_UV.value()}')) # Update text while moving
         self.assist_slider_RED.valueChanged.connect(lambda: self.assist_text_RED.setText(f'Red LED Brightness: {self.assist_slider_RED.value()}'))
         self.assist_slider_GREEN.valueChanged.connect(lambda: self.assist_text_GREEN.setText(f'Green LED Brightness: {self.assist_slider_RED.value()}'))
+        if config.LIVE_PREVIEW: # Also update images while moving
+            self.photo_slider_UV.valueChanged.connect(self.live_preview_changed)
+            self.assist_slider_RED.valueChanged.connect(self.live_preview_changed)
+            self.assist_slider_GREEN.valueChanged.connect(self.live_preview_changed)
         # Start/stop buttons
         self.exposure_START.clicked.connect(self.confirmStart)
         self.exposure_STOP.clicked.connect(self.stopPhotolithography)
+        # Jobs
+        self.job_compile.clicked.connect(self.compileJob)
+        self.job_load.clicked.connect(self.loadJob)
+        self.job_play.clicked.connect(self.playJob)
+        self.greyscale_START.clicked.connect(self.startGreyscaleExposure)
 
     def update_UV_value(self):
         value = self.photo_slider_UV.value()
@@ -329,30 +388,79 @@ class MainWindow(QMainWindow): # Main GUI for controlling photolithography setti
         config.BRIGHTNESS_GREEN = value
         self.update_images()
 
+    def live_preview_changed(self):
+        config.BRIGHTNESS_UV = self.photo_slider_UV.value()
+        config.BRIGHTNESS_RED = self.assist_slider_RED.value()
+        config.BRIGHTNESS_GREEN = self.assist_slider_GREEN.value()
+        if self.live_preview_timer.isActive():
+            self.live_preview_dirty = True # Picked up when the current refresh interval ends
+        else:
+            self.update_images()
+            self.live_preview_timer.start()
+
+    def live_preview_tick(self):
+        if self.live_preview_dirty:
+            self.live_preview_dirty = False
+            self.update_images()
+            self.live_preview_timer.start()
+
     def update_images(self):
         # Update Photo image
-        selected_file = self.photo_cbox.currentText()
-        config.PHOTO_FILE = os.path.join("png_images", selected_file)
+        config.PHOTO_FILE = self.photo_cbox.currentData()
         self.photo_text_file.setText(f'Image File: {config.PHOTO_FILE}')
         # Update Align image
-        selected_file = self.assist_cbox.currentText()
-        config.ALIGNMENT_FILE = os.path.join("png_images", selected_file)
+        config.ALIGNMENT_FILE = self.assist_cbox.currentData()
         self.assist_text_file.setText(f'Image File: {config.ALIGNMENT_FILE}')
 
-        # Remove the old pixmap item, add a newly calculated one
-        self.DLP_preview_scene.removeItem(self.photo_and_align_graphics_item)
-        self.photo_and_align_graphics_item = image_processing.add_images(config.PHOTO_FILE, config.ALIGNMENT_FILE)
-        self.DLP_preview_scene.addItem(self.photo_and_align_graphics_item)
+        # Settings are read now, so a slider moving mid-composite can't mix old and new values.
+        request = (config.PHOTO_FILE, config.ALIGNMENT_FILE,
+                   config.BRIGHTNESS_UV, config.BRIGHTNESS_RED, config.BRIGHTNESS_GREEN,
+                   (config.LITHO_SIZE_PX_X, config.LITHO_SIZE_PX_Y))
+
+        # Seen these exact settings before? Show the finished frame right away.
+        cached = image_processing.cached_frame(*request)
+        if cached is not None:
+            self.preview_worker.cancel() # Anything still in progress is older than this
+            pixmap, frame = cached
+            self.show_preview_pixmap(pixmap, frame)
+            return
+
+        # Otherwise composite on a worker thread; show_preview_frame() swaps the result in.
+        self.preview_worker.request(*request)
+
+    def show_preview_frame(self, serial, request, frame):
+        # Runs on the GUI thread once the worker has a finished frame.
+        # The DLP window shows this same scene, so it updates too.
+        if not self.preview_worker.is_current(serial):
+            return # Queued before a newer frame (e.g. a cache hit) was shown, don't put the old one back
+        self.show_preview_pixmap(image_processing.store_frame(request, frame), frame)
+
+    def show_preview_pixmap(self, pixmap, frame):
+        image_processing.snapshot_writer.submit(frame)
+        self.photo_and_align_graphics_item.setPixmap(pixmap)
+        lithoWindow.surfaces.set_frame(pixmap) # Mid-exposure changes go straight to the DLP, as before (kept back while a sequence plays)
+
+        self.preview_fps.tick()
+        height, width = frame.shape[:2]
+        self.preview_fps_label.setText(f"Preview: {self.preview_fps.fps():.1f} fps ({width} x {height})")
     
     def confirmStart(self):
+        if self.confirmUV(f"Selected Exposure Time: {self.exposure_spinbox.value()} seconds"):
+            self.startPhotolithography()
+
+    def confirmUV(self, exposure_text, uv=None):
+        # Safety confirmation before anything turns the UV on. True if the user confirmed.
+        # uv is the brightness the frames were made with, if not the slider's (a compiled job).
+        if uv is None:
+            uv = self.photo_slider_UV.value()
         warning = QMessageBox()
         warning_text = f"""
             CAUTION! UV LEDs are about to turn on. 
             Ensure the working area is clear and 
             eye protection is being used.
 
-            \nSelected Exposure Time: {self.exposure_spinbox.value()} seconds
-            \nUV Brightness: {self.photo_slider_UV.value()} ({self.photo_slider_UV.value()*100//255}%)
+            \n{exposure_text}
+            \nUV Brightness: {uv} ({uv*100//255}%)
 
             \nCONFIRM UV EXPOSURE:
         """
@@ -367,32 +475,118 @@ class MainWindow(QMainWindow): # Main GUI for controlling photolithography setti
         warning.button
         button = warning.exec()
 
-        if button == confirmButton:
-            self.startPhotolithography()
         if button == cancelButton:
             print("Canceled.")
+        return button == confirmButton
+
+    def compileJob(self):
+        # Bake the selected files and current brightness into a ready-to-display bundle
+        photo_name = os.path.splitext(os.path.basename(config.PHOTO_FILE))[0]
+        align_name = os.path.splitext(os.path.basename(config.ALIGNMENT_FILE))[0]
+        bundle_path = os.path.join(config.JOB_FOLDER, f"{photo_name}__{align_name}.egenjob")
+        if lithoWindow.bundle_path is not None and os.path.abspath(lithoWindow.bundle_path) == os.path.abspath(bundle_path):
+            lithoWindow.unloadBundle() # Its frames are about to be rewritten
+        try:
+            mask_bundle.compile_job(bundle_path, [(config.PHOTO_FILE, config.ALIGNMENT_FILE)])
+            print(f"Compiled job: {bundle_path}")
+        except Exception as e:
+            print(f"Could not compile job: {e}")
+
+    def loadJob(self):
+        bundle_path = QFileDialog.getExistingDirectory(self, "Load Job", config.JOB_FOLDER)
+        if bundle_path:
+            lithoWindow.loadBundle(bundle_path)
+
+    def playJob(self):
+        # Expose all frames of the loaded job back to back. The frames are uploaded before the
+        # first one goes up, so nothing is decoded while the UV is on.
+        if lithoWindow.bundle_frames is None:
+            print("Load a job first.")
+            return
+        duration = self.exposure_spinbox.value()
+        if duration <= 0:
+            print("Set an exposure time per frame first.")
+            return
+        self.frame_sequence.load(lithoWindow.bundle_frames, duration, lithoWindow.surfaces)
+        if not self.confirmUV(f"Job: {len(lithoWindow.bundle_frames)} frames of {duration} seconds, "
+                              f"{self.frame_sequence.total_time():.2f} seconds in total",
+                              uv=lithoWindow.bundle_brightness["BRIGHTNESS_UV"]):
+            return
+        print(f"Playing {len(lithoWindow.bundle_frames)} frames, {self.frame_sequence.total_time():.3f} s in total...")
+        self.exposure_result_label.setText(f"Playing job for {self.frame_sequence.total_time():.2f} s...")
+        self.frame_sequence.play(lithoWindow.surfaces)
+
+    def startGreyscaleExposure(self):
+        # The photo's blue channel is the dose: 255 gets the full exposure time, 128 about half, etc.
+        # It is shown as bit planes, each for its binary-weighted share of the exposure time.
+        full_time = self.exposure_spinbox.value()
+        if full_time <= 0:
+            print("Set the exposure time for a full dose first.")
+            return
+        size = (config.LITHO_SIZE_PX_X, config.LITHO_SIZE_PX_Y)
+        dose = image_processing.dose_map(config.PHOTO_FILE, size) # Flat-field and distortion corrected, like every other frame
+        period = 1.0 / frame_sequence.refresh_rate(lithoWindow.surfaces)
+        frames, durations, bits = dose_planes.dose_sequence(dose, full_time, period, uv=config.BRIGHTNESS_UV)
+        if not frames:
+            print("The dose map is black everywhere, nothing to expose.")
+            return
+        self.frame_sequence.load(frames, durations, lithoWindow.surfaces)
+        if not self.confirmUV(f"Greyscale exposure: {bits} bit planes, "
+                              f"{self.frame_sequence.total_time():.2f} seconds for a full dose"):
+            return
+        print(f"Greyscale exposure: {bits} bit planes, {self.frame_sequence.total_time():.3f} s for a full dose")
+        self.exposure_result_label.setText(f"Greyscale exposure, {bits} bits, {self.frame_sequence.total_time():.2f} s...")
+        self.frame_sequence.play(lithoWindow.surfaces)
+
+    def sequenceFinished(self, result):
+        text = (f"Sequence: {result['presented']} of {result['frames']} frames on time, {result['late']} late, "
+                f"{result['dropped']} dropped; {result['measured_s']:.4f} s of {result['target_s']:.4f} s")
+        self.exposure_result_label.setText(text + (" - STOPPED" if result["aborted"] else ""))
 
     def resizeEvent(self, event):
         super().resizeEvent(event)
 
     def closeEvent(self, a0):
+        self.camFeed.stop() # Let the capture thread finish before Python shuts down
+        image_processing.snapshot_writer.stop(2.0) # Don't cut blended_image.png off halfway through a write
         exit() # Close the whole program if the main window is closed.
         # NOTE: The default splash of the DLP MUST be a black screen, or something with NO blue.
         #       Otherwise, it will emit UV light when the splash screen (or "No-signal" screen) takes over.
 
     def startPhotolithography(self):
         print("Starting UV exposure...")
-        lithoWindow.DLP_scene = self.DLP_preview_scene
-        # lithoWindow.DLP_scene = QGraphicsScene()
-        # lithoWindow.DLP_scene.addItem(self.photo_and_align_graphics_item)
-        lithoWindow.DLP_view = QGraphicsView(lithoWindow.DLP_scene, self)
-        lithoWindow.DLP_view.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        lithoWindow.DLP_view.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        lithoWindow.setCentralWidget(lithoWindow.DLP_view)
+        duration = self.exposure_spinbox.value()
+        if duration > 0:
+            self.exposure_result_label.setText(f"Exposing for {duration:.2f} s...")
+            self.exposure_timer.start(duration, self.showExposure, lithoWindow.blackout)
+        else:
+            self.showExposure() # No time set, on until STOP is clicked
+
+    def showExposure(self):
+        # Switch the DLP to the (pre-built) exposure surface and return the page showing it
+        return lithoWindow.surfaces.show_exposure()
 
     def stopPhotolithography(self):
         print("STOPPING UV exposure.")
-        lithoWindow.blackout()
+        if self.exposure_timer.active():
+            self.exposure_timer.cancel() # Blacks out and logs the shortened exposure
+        elif self.frame_sequence.active():
+            self.frame_sequence.stop()
+        else:
+            lithoWindow.blackout()
+
+    def exposureFinished(self, result):
+        if result["measured_s"] is None:
+            text = f"Exposure ended after {result['commanded_s']:.3f} s (DLP not displayed)"
+        else:
+            text = f"Last exposure: {result['measured_s']:.4f} s on ({result['error_ms']:+.2f} ms)"
+        count, mean, worst = self.exposure_timer.error_stats()
+        if count > 1:
+            text += f", session mean {mean:+.2f} ms, worst {worst:.2f} ms over {count}"
+        switches, switch_mean, switch_worst = lithoWindow.surfaces.switch_stats()
+        if switches:
+            text += f"; DLP switch {switch_mean:.2f} ms mean, {switch_worst:.2f} ms worst"
+        self.exposure_result_label.setText(text + (" - STOPPED" if result["aborted"] else ""))
 
 class DLP():
     def __init__(self):
@@ -418,6 +612,10 @@ class LithoWindow(QMainWindow): # Create the window that the DLP will receieve
     def __init__(self, parentWindow):
         super().__init__()
         self.setWindowTitle("Image")
+        self.parentWindow = parentWindow
+        self.bundle_frames = None
+        self.bundle_path = None
+        self.bundle_brightness = None # What the loaded job was compiled with (it's baked into the frames)
 
         # Attempt to move image to second display
         if DLP.connected:
@@ -436,17 +634,40 @@ class LithoWindow(QMainWindow): # Create the window that the DLP will receieve
             except Exception as e:
                 print(e)
         
+        # Both DLP surfaces are built once here; exposing and blacking out just switch between them.
+        # The exposure surface gets the same frame as the DLP preview, drawn 1:1.
+        self.surfaces = DLPSurfaces()
+        self.surfaces.set_frame(parentWindow.photo_and_align_graphics_item.pixmap())
+        self.setCentralWidget(self.surfaces)
+
         # Finish setting up the window by blacking everything out.
         self.blackout()
 
     def blackout(self):
-        self.blackout_scene = QGraphicsScene()
-        self.blackout_scene.setBackgroundBrush(QBrush(QColor(0, 0, 0))) # Total darkness *evil laugh*
-        self.blackout_view = QGraphicsView(self.blackout_scene)
-        self.blackout_view.setAutoFillBackground(True)
-        self.blackout_view.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        self.blackout_view.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        self.setCentralWidget(self.blackout_view)
+        return self.surfaces.show_blackout()
+
+    def loadBundle(self, bundle_path, index=0):
+        # Show a frame from a precompiled job. The frames are memory-mapped and already composited,
+        # so there's no decoding or image math here (out-of-date bundles are recompiled first).
+        self.unloadBundle() # A stale bundle is rewritten in place, which Windows refuses while it's mapped
+        try:
+            frames, meta = mask_bundle.load_or_compile(bundle_path)
+        except Exception as e:
+            print(f"Could not load job {bundle_path}: {e}")
+            return
+        self.bundle_frames, self.bundle_path = frames, bundle_path
+        self.bundle_brightness = mask_bundle.stored_brightness(meta)
+        pixmap = image_processing.frame_to_pixmap(self.bundle_frames[index])
+        self.parentWindow.photo_and_align_graphics_item.setPixmap(pixmap)
+        self.surfaces.set_frame(pixmap)
+        print(f"Loaded job {bundle_path} (frame {index + 1} of {len(self.bundle_frames)}), compiled at "
+              + ", ".join(f"{key[11:]} {value}" for key, value in self.bundle_brightness.items()))
+
+    def unloadBundle(self):
+        # Drop the memory map of the loaded job's frames
+        self.bundle_frames = None
+        self.bundle_path = None
+        self.bundle_brightness = None
 
 
 app = QApplication(sys.argv)
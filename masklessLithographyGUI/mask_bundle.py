@@ -0,0 +1,169 @@
+# Precompiled exposure jobs ("mask bundles").
+#
+# Normally every exposure starts from the source PNGs, which are decoded, resized and
+# composited when START is clicked. compile_job() does all of that ahead of time and writes
+# the finished frames to a bundle folder:
+#
+#   <name>.egenjob/
+#       frames.npy  - (frames, height, width, 3) uint8, loaded memory-mapped (no decoding at all)
+#       job.json    - size, brightness, config values and the sources (path, size, mtime, sha256)
+#
+# load_bundle() refuses a bundle whose sources or config values have changed since it was
+# compiled, and load_or_compile() simply rebuilds it in that case. The LED brightness is part of
+# the job (it sets the dose), not of the config check: moving a slider after compiling doesn't
+# make a bundle stale, and a rebuild uses the brightness stored in job.json, not the sliders'.
+#
+# frames.npy is written under a temporary name and swapped in when complete. The GUI drops its
+# memory map of a bundle before rebuilding it, as Windows can't replace a file that is mapped.
+
+import hashlib
+import json
+import os
+import numpy as np
+from numpy.lib.format import open_memmap
+import config
+import image_processing
+
+BUNDLE_VERSION = 3  # 2: RESAMPLE_MODE "auto" resizes greyscale layers bicubic again (was box); 3: brightness in job.json
+FRAMES_FILE = "frames.npy"
+META_FILE = "job.json"
+
+# Config values that change what the frames look like
+CONFIG_KEYS = ["LITHO_SIZE_PX_X", "LITHO_SIZE_PX_Y", "RESAMPLE_MODE", "SVG_ANTIALIAS",
+               "DISTORTION_CALIBRATION", "DISTORTION_INTERPOLATION", "FLAT_FIELD_MAP"]
+BRIGHTNESS_KEYS = ["BRIGHTNESS_UV", "BRIGHTNESS_RED", "BRIGHTNESS_GREEN"]
+
+
+class StaleBundleError(Exception):
+    """The bundle no longer matches its source files or the current config"""
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def describe_source(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_sha256(path)}
+
+
+def config_snapshot():
+    return {key: getattr(config, key) for key in CONFIG_KEYS}
+
+
+def stored_brightness(meta):
+    """{BRIGHTNESS_UV: .., ...} a bundle was compiled with (older bundles kept it in "config"), or None"""
+    brightness = meta.get("brightness", meta.get("config", {}))
+    if all(key in brightness for key in BRIGHTNESS_KEYS):
+        return {key: brightness[key] for key in BRIGHTNESS_KEYS}
+    return None
+
+
+def compile_job(bundle_path, layers, brightness=None):
+    """Composite every (photo path, align path) pair in `layers` with the current config and write a bundle.
+
+    `brightness` is {BRIGHTNESS_UV: .., BRIGHTNESS_RED: .., BRIGHTNESS_GREEN: ..}, by default the
+    current config values. Frames are written one at a time into the memory-mapped output, so a
+    long job doesn't need all frames in memory at once.
+    """
+    if brightness is None:
+        brightness = {key: getattr(config, key) for key in BRIGHTNESS_KEYS}
+    size = (config.LITHO_SIZE_PX_X, config.LITHO_SIZE_PX_Y)
+    os.makedirs(bundle_path, exist_ok=True)
+    meta_path = os.path.join(bundle_path, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path) # Invalid until the new frames are complete
+    frames_path = os.path.join(bundle_path, FRAMES_FILE)
+    temp_path = frames_path + ".tmp"
+    frames = open_memmap(temp_path, mode="w+", dtype=np.uint8, shape=(len(layers), size[1], size[0], 3))
+    sources = {}
+    for index, (img_photo_path, img_align_path) in enumerate(layers):
+        frames[index] = image_processing.composite_frame(
+            img_photo_path, img_align_path,
+            brightness["BRIGHTNESS_UV"], brightness["BRIGHTNESS_RED"], brightness["BRIGHTNESS_GREEN"], size)
+        for path in (img_photo_path, img_align_path):
+            if path not in sources:
+                sources[path] = describe_source(path)
+    # Frames are pre-warped and flat-field compensated with these
+    for path in (config.DISTORTION_CALIBRATION, config.FLAT_FIELD_MAP):
+        if path:
+            sources[path] = describe_source(path)
+    frames.flush()
+    del frames # Closes the map, so the file can be renamed
+    os.replace(temp_path, frames_path)
+
+    meta = {
+        "version": BUNDLE_VERSION,
+        "size": list(size),
+        "brightness": brightness,
+        "config": config_snapshot(),
+        "layers": [list(pair) for pair in layers],
+        "sources": sources,
+    }
+    # Metadata goes last, so a half-written bundle never looks valid
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def read_meta(bundle_path):
+    with open(os.path.join(bundle_path, META_FILE)) as f:
+        return json.load(f)
+
+
+def stale_reason(meta):
+    """Why a bundle is out of date, or None if it is still good"""
+    if meta.get("version") != BUNDLE_VERSION:
+        return f"bundle version {meta.get('version')} (expected {BUNDLE_VERSION})"
+    current = config_snapshot()
+    for key, value in meta["config"].items():
+        if current.get(key) != value:
+            return f"config.{key} changed ({value} -> {current.get(key)})"
+    for path, source in meta["sources"].items():
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return f"{path} is missing"
+        if stat.st_size == source["size"] and stat.st_mtime_ns == source["mtime_ns"]:
+            continue  # Unchanged, no need to hash it
+        if stat.st_size != source["size"] or file_sha256(path) != source["sha256"]:
+            return f"{path} changed"
+    return None
+
+
+def load_bundle(bundle_path, check=True):
+    """Returns (frames, meta); frames is a read-only memory map of shape (frames, height, width, 3)"""
+    meta = read_meta(bundle_path)
+    if check:
+        reason = stale_reason(meta)
+        if reason is not None:
+            raise StaleBundleError(f"{bundle_path} is out of date: {reason}")
+    frames = np.load(os.path.join(bundle_path, FRAMES_FILE), mmap_mode="r")
+    return frames, meta
+
+
+def load_or_compile(bundle_path, layers=None):
+    """Load a bundle, (re)compiling it first if it is missing or out of date.
+
+    `layers` is only needed for a bundle that doesn't exist yet; otherwise the layer list
+    stored in the bundle is reused.
+    """
+    try:
+        return load_bundle(bundle_path)
+    except (OSError, StaleBundleError) as e:
+        brightness = None
+        try:
+            meta = read_meta(bundle_path)
+            brightness = stored_brightness(meta) # Rebuild with the job's own dose, not the sliders
+            if layers is None:
+                layers = [tuple(pair) for pair in meta["layers"]]
+        except OSError:
+            if layers is None:
+                raise e
+        print(f"Compiling job {bundle_path}: {e}")
+        compile_job(bundle_path, layers, brightness)
+        return load_bundle(bundle_path)
@@ -0,0 +1,126 @@
+# Runs preview compositing on a QThreadPool instead of the GUI thread.
+#
+# Every combobox change or slider release calls request(). If a frame is already being
+# composited, the new request just replaces whatever was waiting (latest wins), so a burst
+# of changes only ever costs the frame in progress plus the newest one.
+# Finished frames come back through the frameReady signal, which Qt delivers on the
+# GUI thread, where they can be turned into a QPixmap and swapped into the preview scene.
+# The signal carries the request's serial number: a frame can already be queued for delivery
+# when cancel() is called, so the GUI checks is_current(serial) when it arrives and drops it
+# if the GUI has shown something newer since (e.g. a frame cache hit).
+
+import threading
+import time
+from collections import deque
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+import image_processing
+
+
+class _CompositeJob(QRunnable):
+    def __init__(self, worker):
+        super().__init__()
+        self.worker = worker
+
+    def run(self):
+        self.worker._run_pending()
+
+
+class PreviewWorker(QObject):
+    """Composites preview frames in the background, coalescing requests that pile up"""
+
+    frameReady = pyqtSignal(int, object, object)  # (serial, request tuple, RGB uint8 frame)
+    failed = pyqtSignal(object, str)  # (request tuple, error message)
+
+    def __init__(self, parent=None, pool=None):
+        super().__init__(parent)
+        self.pool = pool if pool is not None else QThreadPool.globalInstance()
+
+        # Counters
+        self.requested = 0
+        self.computed = 0
+        self.coalesced = 0  # Requests that were replaced before they were computed
+        self.discarded = 0  # Frames finished after cancel() and never shown
+
+        self._pending = None
+        self._pending_serial = 0
+        self._cancelled_serial = 0  # Results of requests up to this number are dropped
+        self._running = False
+        self._lock = threading.Lock()
+
+    def request(self, img_photo_path, img_align_path, uv, red, green, size):
+        """Ask for a new frame. All settings are passed in, so the job never reads config mid-change."""
+        job = None
+        with self._lock:
+            self.requested += 1
+            if self._pending is not None:
+                self.coalesced += 1
+            self._pending = (img_photo_path, img_align_path, uv, red, green, tuple(size))
+            self._pending_serial = self.requested
+            if not self._running:
+                self._running = True
+                job = _CompositeJob(self)
+        if job is not None:
+            self.pool.start(job)
+
+    def cancel(self):
+        """Drop the waiting request and don't deliver the one in progress (e.g. the GUI already has a newer frame)"""
+        with self._lock:
+            if self._pending is not None:
+                self.coalesced += 1
+            self._pending = None
+            self._cancelled_serial = self.requested
+
+    def is_current(self, serial):
+        """False if the request with this serial was cancelled; call it on the GUI thread when frameReady arrives"""
+        with self._lock:
+            if serial <= self._cancelled_serial:
+                self.discarded += 1
+                return False
+            return True
+
+    def busy(self):
+        with self._lock:
+            return self._running
+
+    def _run_pending(self):
+        # Keep going until nothing new was requested while we were working
+        while True:
+            with self._lock:
+                request, self._pending = self._pending, None
+                serial = self._pending_serial
+                if request is None:
+                    self._running = False
+                    return
+            try:
+                frame = image_processing.composite_frame(*request)
+            except Exception as e:
+                self.failed.emit(request, str(e))
+                continue
+            self.computed += 1
+            with self._lock:
+                if serial <= self._cancelled_serial:
+                    self.discarded += 1
+                    continue # Already stale, don't bother the GUI thread
+            self.frameReady.emit(serial, request, frame)
+
+
+class FrameRateMeter:
+    """Counts presented frames and reports the rate over a sliding time window"""
+
+    def __init__(self, window=1.0):
+        self.window = window  # seconds
+        self.total = 0
+        self._times = deque()
+
+    def tick(self):
+        now = time.perf_counter()
+        self.total += 1
+        self._times.append(now)
+        while self._times and now - self._times[0] > self.window:
+            self._times.popleft()
+
+    def fps(self):
+        if len(self._times) < 2:
+            return 0.0
+        span = self._times[-1] - self._times[0]
+        return (len(self._times) - 1) / span if span > 0 else 0.0
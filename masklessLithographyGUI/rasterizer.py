@@ -0,0 +1,413 @@
+# Scanline rasterizer for vector masks (polygons and SVG paths), without going through PNGs.
+#
+# A design is a list of Shapes. Each Shape is one filled outline (an SVG <path>, <rect> or
+# <polygon>), made of one or more closed rings, e.g. a letter "O" is an outer and an inner ring.
+# rasterize() fills shapes into any rectangle of the design, at one of two outputs:
+#   - antialias=1: a BitMask (pixel centres inside the shape are on), ready for composite_layers
+#   - antialias=N: a uint8 coverage plane from N x N samples per pixel (0 = dark, 255 = fully UV)
+#
+# How the fill works (all numpy, no per-pixel Python loops):
+#   Every edge is intersected with every sample row it crosses, giving a (row, column,
+#   direction) crossing. Sorted along the rows, a running sum of the directions (+1 down,
+#   -1 up) is the winding number between one crossing and the next, and "nonzero" / "evenodd"
+#   decides if that span is inside. The spans are then written out in one go with np.repeat
+#   (run lengths), so the work per row depends on the number of edges, not the width.
+#   The rows are done in bands of BAND_SAMPLES sample rows, and each shape only over its own
+#   bounding box, so temporaries stay small even for 4K frames with 4x4 antialiasing.
+#
+# Filled shapes are the UV-exposed areas, like the "(White)" PNG exports (the SVGs themselves
+# draw the shapes in black on white).
+#
+# PolygonIndex buckets shapes by grid cell, so a tile only rasterizes the shapes that touch it.
+# PolygonMaskSource cuts a big design into DLP-sized tiles, like tiled_mask.TiledMaskSource.
+
+import math
+import re
+import xml.etree.ElementTree as ElementTree
+import numpy as np
+import config
+from bitmask import BitMask
+
+BAND_SAMPLES = 256  # Sample rows filled at once
+INDEX_CELL = 256  # Pixels per PolygonIndex grid cell
+MAX_ANTIALIAS = 15  # Samples per pixel side; per-pixel counts (up to 15 x 15) fit in a uint8
+CURVE_TOLERANCE = 0.1  # Max distance (px) between a Bezier curve and the lines it's flattened to
+
+
+class Shape:
+    """One filled outline: a list of closed rings ((N, 2) float arrays of x, y in pixels) and a fill rule"""
+
+    def __init__(self, rings, fill_rule="nonzero"):
+        if fill_rule not in ("nonzero", "evenodd"):
+            raise ValueError(f"Unknown fill rule {fill_rule}")
+        self.rings = [np.asarray(ring, dtype=np.float64) for ring in rings if len(ring) >= 3]
+        self.fill_rule = fill_rule
+        # Every edge as (x0, y0, x1, y1); each ring is closed back to its first point
+        if self.rings:
+            self.edges = np.concatenate([np.hstack([ring, np.roll(ring, -1, axis=0)]) for ring in self.rings])
+            points = np.concatenate(self.rings)
+            self.bbox = (points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max())
+        else:
+            self.edges = np.empty((0, 4))
+            self.bbox = (0.0, 0.0, 0.0, 0.0)
+
+    def transformed(self, scale_x, scale_y, offset_x=0.0, offset_y=0.0):
+        scale = np.array([scale_x, scale_y])
+        offset = np.array([offset_x, offset_y])
+        return Shape([ring * scale + offset for ring in self.rings], self.fill_rule)
+
+
+def _fill_band(shape, inside, x0, y0, samples):
+    # OR one shape into `inside`, a (rows, columns) bool sample grid whose top-left sample
+    # corner is design pixel (x0, y0), with `samples` samples per pixel in each direction.
+    rows, columns = inside.shape
+    bx0 = max(0, int(math.floor((shape.bbox[0] - x0) * samples)))
+    bx1 = min(columns, int(math.ceil((shape.bbox[2] - x0) * samples)) + 1)
+    by0 = max(0, int(math.floor((shape.bbox[1] - y0) * samples)))
+    by1 = min(rows, int(math.ceil((shape.bbox[3] - y0) * samples)) + 1)
+    if bx0 >= bx1 or by0 >= by1:
+        return
+
+    # Edges in sample coordinates, relative to the shape's box within this band
+    xa = (shape.edges[:, 0] - x0) * samples - bx0
+    ya = (shape.edges[:, 1] - y0) * samples - by0
+    xb = (shape.edges[:, 2] - x0) * samples - bx0
+    yb = (shape.edges[:, 3] - y0) * samples - by0
+
+    # Sample row j (centre at j + 0.5) is crossed by an edge if min(y) <= j + 0.5 < max(y)
+    height = by1 - by0
+    first = np.clip(np.ceil(np.minimum(ya, yb) - 0.5), 0, height).astype(np.intp)
+    last = np.clip(np.ceil(np.maximum(ya, yb) - 0.5), 0, height).astype(np.intp)
+    counts = last - first
+    crossing = np.nonzero(counts > 0)[0]  # Horizontal edges never cross a sample row
+    if len(crossing) == 0:
+        return
+    counts = counts[crossing]
+
+    # One entry per (edge, row) crossing
+    edge = np.repeat(crossing, counts)
+    row = np.repeat(first[crossing] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    t = (row + 0.5 - ya[edge]) / (yb[edge] - ya[edge])
+    x = xa[edge] + t * (xb[edge] - xa[edge])
+    # Samples from the first centre at or right of the crossing onwards are affected
+    width = bx1 - bx0
+    column = np.clip(np.ceil(x - 0.5), 0, width).astype(np.intp)
+    if shape.fill_rule == "nonzero":
+        weight = np.where(yb[edge] > ya[edge], 1, -1)
+    else:
+        weight = np.ones(len(edge), dtype=np.intp)
+
+    # Walk the box row by row as one flat run of height * (width + 1) samples. The extra column
+    # takes crossings right of the box. Every row's crossings add up to 0 (the rings are closed),
+    # so a running sum over all of them in order is the winding number within each row.
+    position = row * (width + 1) + column
+    order = np.argsort(position, kind="stable")
+    position = position[order]
+    winding = np.cumsum(weight[order])
+    if shape.fill_rule == "nonzero":
+        span_inside = winding != 0
+    else:
+        span_inside = (winding % 2) == 1
+    # Run i (after crossing i) lasts until the next crossing; before the first one it's outside
+    runs = np.diff(position, prepend=0, append=height * (width + 1))
+    filled = np.repeat(np.concatenate([[False], span_inside]), runs)
+    inside[by0:by1, bx0:bx1] |= filled.reshape(height, width + 1)[:, :width]
+
+
+def rasterize(shapes, x0, y0, width, height, antialias=1):
+    """Fill `shapes` into the design rectangle starting at pixel (x0, y0).
+
+    Returns a BitMask for antialias=1, otherwise a (height, width) uint8 coverage plane.
+    """
+    samples = int(antialias)
+    if not 1 <= samples <= MAX_ANTIALIAS:
+        raise ValueError(f"antialias must be 1 to {MAX_ANTIALIAS}, got {antialias}")
+    if samples == 1:
+        packed = np.zeros((height, (width + 7) // 8), dtype=np.uint8)
+    else:
+        coverage = np.zeros((height, width), dtype=np.uint8)
+    # Samples hit -> 0..255
+    full = samples * samples
+    coverage_lut = ((np.arange(full + 1) * 255 + full // 2) // full).astype(np.uint8)
+
+    band_rows = max(1, BAND_SAMPLES // samples)  # Pixel rows per band
+    for row in range(0, height, band_rows):
+        rows = min(band_rows, height - row)
+        band_y0 = y0 + row
+        band_shapes = [shape for shape in shapes
+                       if shape.bbox[1] < band_y0 + rows and shape.bbox[3] >= band_y0
+                       and shape.bbox[0] < x0 + width and shape.bbox[2] >= x0]
+        if not band_shapes:
+            continue
+        inside = np.zeros((rows * samples, width * samples), dtype=bool)
+        for shape in band_shapes:
+            _fill_band(shape, inside, x0, band_y0, samples)
+        if samples == 1:
+            packed[row:row + rows] = np.packbits(inside, axis=1)
+        else:
+            # Count the samples per pixel with a few strided adds (much faster than .sum over two axes)
+            grid = inside.view(np.uint8).reshape(rows, samples, width, samples)
+            hits = grid[:, 0].copy()
+            for k in range(1, samples):
+                hits += grid[:, k]
+            counts = hits[..., 0].copy()
+            for k in range(1, samples):
+                counts += hits[..., k]
+            coverage[row:row + rows] = np.take(coverage_lut, counts)
+
+    if samples == 1:
+        return BitMask(packed, width)
+    return coverage
+
+
+def as_layer(tile):
+    """A rasterize() result in the form composite_layers takes (BitMask, or a read-only RGB view)"""
+    if isinstance(tile, BitMask):
+        return tile
+    return np.broadcast_to(tile[..., None], tile.shape + (3,))
+
+
+class PolygonIndex:
+    """Uniform grid over the design, mapping each cell to the shapes whose bounding box touches it"""
+
+    def __init__(self, shapes, cell=INDEX_CELL):
+        self.shapes = shapes
+        self.cell = cell
+        self.cells = {}
+        for number, shape in enumerate(shapes):
+            if not shape.rings:
+                continue
+            cx0, cy0 = int(shape.bbox[0] // cell), int(shape.bbox[1] // cell)
+            cx1, cy1 = int(shape.bbox[2] // cell), int(shape.bbox[3] // cell)
+            for cy in range(cy0, cy1 + 1):
+                for cx in range(cx0, cx1 + 1):
+                    self.cells.setdefault((cx, cy), []).append(number)
+
+    def query(self, x0, y0, x1, y1):
+        """Shapes (in their original order) that may overlap the rectangle [x0, x1) x [y0, y1)"""
+        found = set()
+        for cy in range(int(y0 // self.cell), int((y1 - 1) // self.cell) + 1):
+            for cx in range(int(x0 // self.cell), int((x1 - 1) // self.cell) + 1):
+                found.update(self.cells.get((cx, cy), ()))
+        return [self.shapes[number] for number in sorted(found)]
+
+
+class PolygonMaskSource:
+    """Rasterizes fixed-size tiles (with optional overlap) of a vector design on demand"""
+
+    def __init__(self, shapes, width, height, tile_size=None, overlap=0, antialias=1):
+        # width/height is the design size in pixels, tile_size is (width, height), one DLP field by default
+        self.width = width
+        self.height = height
+        self.tile_width, self.tile_height = tile_size if tile_size is not None else (config.LITHO_SIZE_PX_X, config.LITHO_SIZE_PX_Y)
+        if not 0 <= overlap < min(self.tile_width, self.tile_height):
+            raise ValueError(f"Overlap of {overlap} px doesn't fit a {self.tile_width} x {self.tile_height} tile")
+        self.overlap = overlap
+        self.antialias = antialias
+        self.index = PolygonIndex(shapes)
+
+        step_x = self.tile_width - overlap
+        step_y = self.tile_height - overlap
+        self.columns = max(1, -(-(self.width - overlap) // step_x))
+        self.rows = max(1, -(-(self.height - overlap) // step_y))
+
+    def tile_origin(self, column, row):
+        """Top-left design pixel of a tile"""
+        return (column * (self.tile_width - self.overlap), row * (self.tile_height - self.overlap))
+
+    def tile(self, column, row):
+        """One tile (BitMask, or uint8 coverage when antialiased). Past the design edge is dark."""
+        x0, y0 = self.tile_origin(column, row)
+        shapes = self.index.query(x0, y0, x0 + self.tile_width, y0 + self.tile_height)
+        if x0 + self.tile_width > self.width or y0 + self.tile_height > self.height:
+            # Clip the edge tile to the design area
+            width = max(0, min(self.tile_width, self.width - x0))
+            height = max(0, min(self.tile_height, self.height - y0))
+            part = rasterize(shapes, x0, y0, width, height, self.antialias)
+            plane = np.zeros((self.tile_height, self.tile_width), dtype=np.uint8)
+            plane[:height, :width] = part.to_array() if isinstance(part, BitMask) else part
+            return BitMask.from_array(plane) if self.antialias == 1 else plane
+        return rasterize(shapes, x0, y0, self.tile_width, self.tile_height, self.antialias)
+
+    def __iter__(self):
+        """Yields (column, row, tile) for every tile, row by row"""
+        for row in range(self.rows):
+            for column in range(self.columns):
+                yield column, row, self.tile(column, row)
+
+    def __len__(self):
+        return self.rows * self.columns
+
+
+# --- SVG input ---------------------------------------------------------------------------
+
+_PATH_TOKEN = re.compile(r"[MmLlHhVvCcSsQqTtAaZz]|[-+]?(?:\d*\.\d+|\d+\.?)(?:[eE][-+]?\d+)?")
+
+
+def _curve_segments(points, tolerance):
+    # Enough line segments that the flattened curve stays within `tolerance` of the real one
+    bend = np.abs(points[:-2] - 2 * points[1:-1] + points[2:]).max() if len(points) > 2 else 0.0
+    return max(1, int(math.ceil(math.sqrt(0.75 * bend / tolerance)))) if bend > 0 else 1
+
+
+def _flatten_cubic(p0, p1, p2, p3, tolerance):
+    n = _curve_segments(np.array([p0, p1, p2, p3]), tolerance)
+    t = np.linspace(0.0, 1.0, n + 1)[1:, None]
+    u = 1.0 - t
+    return u ** 3 * p0 + 3 * u * u * t * p1 + 3 * u * t * t * p2 + t ** 3 * p3
+
+
+def _flatten_quadratic(p0, p1, p2, tolerance):
+    n = _curve_segments(np.array([p0, p1, p2]), tolerance)
+    t = np.linspace(0.0, 1.0, n + 1)[1:, None]
+    u = 1.0 - t
+    return u * u * p0 + 2 * u * t * p1 + t * t * p2
+
+
+def parse_path(d, scale=(1.0, 1.0), tolerance=CURVE_TOLERANCE):
+    """Rings of an SVG path "d" attribute, scaled by (sx, sy). Curves are flattened to lines.
+
+    Supports M L H V C S Q T Z (absolute and relative). Arcs (A) are not supported.
+    """
+    tokens = _PATH_TOKEN.findall(d)
+    scale = np.array(scale, dtype=np.float64)
+    rings = []
+    ring = []
+    current = np.zeros(2)
+    start = np.zeros(2)
+    last_control = None  # For the smooth S/T commands
+    last_command = ""
+    command = None
+    i = 0
+
+    def numbers(count):
+        nonlocal i
+        chunk = tokens[i:i + count]
+        if len(chunk) != count or any(v.isalpha() for v in chunk):
+            raise ValueError(f"Malformed path data near token {i}")
+        values = [float(v) for v in chunk]
+        i += count
+        return np.array(values).reshape(-1, 2) * scale if count > 1 else values[0]
+
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            command = tokens[i]
+            i += 1
+        elif command is None:
+            raise ValueError("Path data doesn't start with a command")
+        relative = command.islower()
+        origin = current if relative else np.zeros(2)
+        upper = command.upper()
+
+        if upper == "M":
+            if len(ring) >= 3:
+                rings.append(np.array(ring))
+            current = origin + numbers(2)[0]
+            start = current
+            ring = [current]
+            command = "l" if relative else "L"  # Extra coordinate pairs are line-tos
+        elif upper == "L":
+            current = origin + numbers(2)[0]
+            ring.append(current)
+        elif upper == "H":
+            x = numbers(1) * scale[0]
+            current = np.array([current[0] + x if relative else x, current[1]])
+            ring.append(current)
+        elif upper == "V":
+            y = numbers(1) * scale[1]
+            current = np.array([current[0], current[1] + y if relative else y])
+            ring.append(current)
+        elif upper in ("C", "S"):
+            if upper == "C":
+                c1, c2, end = origin + numbers(6)
+            else:
+                c2, end = origin + numbers(4)
+                c1 = 2 * current - last_control if last_command in ("C", "S") else current
+            ring.extend(_flatten_cubic(current, c1, c2, end, tolerance))
+            last_control = c2
+            current = end
+        elif upper in ("Q", "T"):
+            if upper == "Q":
+                c1, end = origin + numbers(4)
+            else:
+                end = origin + numbers(2)[0]
+                c1 = 2 * current - last_control if last_command in ("Q", "T") else current
+            ring.extend(_flatten_quadratic(current, c1, end, tolerance))
+            last_control = c1
+            current = end
+        elif upper == "Z":
+            if len(ring) >= 3:
+                rings.append(np.array(ring))
+            current = start
+            ring = [current]
+        else:
+            raise ValueError(f"Path command {command} is not supported")
+        last_command = upper
+    if len(ring) >= 3:
+        rings.append(np.array(ring))
+    return rings
+
+
+_UNSUPPORTED = {"circle", "ellipse", "line", "polyline", "text", "image", "use"}  # Drawn, but not by load_svg
+_NOT_DRAWN = re.compile(r"display\s*:\s*none|fill\s*:\s*none")
+
+
+def _hidden_classes(root):
+    # Classes that a <style> block hides or leaves unfilled (Illustrator puts hidden layers
+    # and guide rectangles there)
+    hidden = set()
+    for style in root.iter("{http://www.w3.org/2000/svg}style"):
+        for selectors, body in re.findall(r"([^{}]+)\{([^}]*)\}", style.text or ""):
+            if _NOT_DRAWN.search(body):
+                hidden.update(name[1:] for name in re.findall(r"\.[\w-]+", selectors))
+    return hidden
+
+
+def load_svg(svg_path, size=None, tolerance=CURVE_TOLERANCE, strict=False):
+    """Filled shapes of an SVG, stretched so the viewBox fills size = (width, height) pixels.
+
+    Without a size the shapes stay in SVG user units. Handles <path>, <rect> and <polygon>;
+    hidden or unfilled (display: none, fill: none) elements are skipped, and transforms are not supported.
+    Visible elements it can't draw are skipped with a message, or raise ValueError with strict=True.
+    """
+    root = ElementTree.parse(svg_path).getroot()
+    view = [float(v) for v in re.split(r"[\s,]+", root.get("viewBox", "").strip()) if v]
+    if len(view) != 4:
+        view = [0.0, 0.0, float(root.get("width", "0").rstrip("px")), float(root.get("height", "0").rstrip("px"))]
+    scale = (1.0, 1.0) if size is None else (size[0] / view[2], size[1] / view[3])
+    hidden = _hidden_classes(root)
+
+    shapes = []
+
+    def walk(element):
+        if set((element.get("class") or "").split()) & hidden or element.get("display") == "none" \
+                or element.get("fill") == "none" or _NOT_DRAWN.search(element.get("style") or ""):
+            return
+        tag = element.tag.rsplit("}", 1)[-1]
+        if element.get("transform") or tag in _UNSUPPORTED:
+            problem = f"an element with a transform ({element.get('transform')})" if element.get("transform") else f"<{tag}>"
+            if strict:
+                raise ValueError(f"{svg_path}: {problem} is not supported")
+            print(f"{svg_path}: skipping {problem}")
+            return
+        fill_rule = "evenodd" if "evenodd" in (element.get("fill-rule") or element.get("style") or "") else "nonzero"
+        if tag == "path":
+            rings = parse_path(element.get("d", ""), scale, tolerance)
+        elif tag == "rect":
+            x, y = float(element.get("x", 0)), float(element.get("y", 0))
+            w, h = float(element.get("width", 0)), float(element.get("height", 0))
+            rings = [np.array([[x, y], [x + w, y], [x + w, y + h], [x, y + h]]) * scale]
+        elif tag == "polygon":
+            points = [float(v) for v in re.split(r"[\s,]+", element.get("points", "").strip()) if v]
+            rings = [np.array(points).reshape(-1, 2) * scale]
+        else:
+            rings = None
+        if rings:
+            shape = Shape(rings, fill_rule)
+            # Shift so the viewBox origin is pixel (0, 0)
+            shapes.append(shape.transformed(1.0, 1.0, -view[0] * scale[0], -view[1] * scale[1]))
+        for child in element:
+            walk(child)
+
+    walk(root)
+    return shapes
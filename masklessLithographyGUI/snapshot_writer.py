@@ -0,0 +1,88 @@
+# Background writer for the blended_image.png reference snapshot.
+#
+# PNG compression of a full frame takes long enough to make the GUI stutter,
+# so add_images just hands the finished frame to this writer and carries on.
+# Only the newest frame is kept: if several previews come in while a write is still
+# running, the older ones are skipped (nobody needs a PNG of an intermediate slider value).
+
+import os
+import threading
+import time
+from collections import deque
+from PIL import Image
+
+
+class SnapshotWriter:
+    """Writes the latest submitted frame to a PNG on a worker thread"""
+
+    def __init__(self, path, enabled=True):
+        self.path = path
+        self.enabled = enabled
+
+        # Timing/counters
+        self.write_times = deque(maxlen=100)  # Seconds per write, most recent last
+        self.written = 0
+        self.skipped = 0  # Frames replaced by a newer one before they were written
+
+        self._pending = None
+        self._stopping = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def submit(self, frame):
+        """Queue an RGB uint8 frame for writing. The frame must not be modified afterwards."""
+        if not self.enabled:
+            return
+        with self._condition:
+            if self._pending is not None:
+                self.skipped += 1
+            self._pending = frame
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="SnapshotWriter", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def last_write_time(self):
+        return self.write_times[-1] if self.write_times else None
+
+    def stop(self, timeout=None):
+        """Finish the pending write (if any) and stop the worker thread.
+
+        Returns False if the thread is still writing after `timeout`; it then stops by itself
+        once done, and frames submitted meanwhile are written by it rather than a second thread.
+        """
+        with self._condition:
+            thread = self._thread
+            if thread is None:
+                return True
+            self._stopping = True
+            self._condition.notify()
+        thread.join(timeout)
+        if thread.is_alive():
+            print(f"Snapshot writer still busy with {self.path}, it will stop after this write")
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._stopping:
+                    self._condition.wait()
+                frame, self._pending = self._pending, None
+                if frame is None:
+                    # Stopping and nothing left to write. Cleared here, under the lock, so a
+                    # submit() from now on starts a new thread and never a second one.
+                    self._thread = None
+                    self._stopping = False
+                    return
+
+            start = time.perf_counter()
+            try:
+                # Write next to the target and swap it in, so readers never see a half-written PNG
+                temp_path = self.path + ".tmp"
+                Image.fromarray(frame[..., :3], "RGB").save(temp_path, format="PNG")
+                os.replace(temp_path, self.path)
+                self.written += 1
+            except Exception as e:
+                print(f"Could not save snapshot {self.path}: {e}")
+            self.write_times.append(time.perf_counter() - start)
@@ -0,0 +1,130 @@
+# Renders SVG masks straight onto the DLP pixel grid, with a disk cache.
+#
+# The PNGs in png_images are exports of the SVGs in svg_images at some other resolution, so
+# every preview/exposure had to decode a big PNG and then resample it (blurring or shifting
+# edges by up to a pixel). An SVG is instead rendered once at exactly the requested
+# (width, height) and the result is saved in config.SVG_CACHE_FOLDER, keyed by
+# (sha256 of the SVG, width, height, antialias). Editing the SVG changes the hash,
+# so stale renders are never picked up.
+#
+# SVGs are filled by rasterizer.py (vectorized numpy scanline fill, several times faster than Qt
+# at DLP resolutions). If one uses something it can't draw (arcs, transforms, embedded images,
+# circles, text...), QSvgRenderer renders it instead.
+#
+# Like the PNG exports, the SVG is drawn on a white background and stretched to fill the frame.
+# Without antialiasing the render is snapped to pure black/white (the SVG's "black" is usually
+# something like #231f20), so it becomes a BitMask layer in image_processing.load_layer.
+
+import hashlib
+import os
+from functools import lru_cache
+from xml.etree.ElementTree import ParseError
+import numpy as np
+import config
+import rasterizer
+from PIL import Image
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage, QPainter
+from PyQt5.QtSvg import QSvgRenderer
+from bitmask import pack_if_binary
+
+VECTOR_ANTIALIAS = 4  # Samples per pixel side when rasterizer.py antialiases
+
+# Rendering counters
+renders = 0
+qt_renders = 0  # Renders rasterizer.py couldn't do
+disk_hits = 0
+
+
+def is_svg(img_path):
+    return img_path.lower().endswith(".svg")
+
+
+@lru_cache(maxsize=256)
+def _svg_sha256(abs_path, mtime_ns, file_size):
+    # mtime and size are only in the arguments so an edited file is hashed again
+    with open(abs_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def svg_sha256(svg_path):
+    stat = os.stat(svg_path)
+    return _svg_sha256(os.path.abspath(svg_path), stat.st_mtime_ns, stat.st_size)
+
+
+def cache_path(svg_path, size, antialias):
+    sha = svg_sha256(svg_path)
+    name = f"{sha[:32]}_{size[0]}x{size[1]}_{'aa' if antialias else 'bw'}.png"
+    return os.path.join(config.SVG_CACHE_FOLDER, name)
+
+
+def render_svg(svg_path, size, antialias=False):
+    """Render an SVG to a (height, width, 3) uint8 array of exactly size = (width, height)"""
+    renderer = QSvgRenderer(svg_path)
+    if not renderer.isValid():
+        raise ValueError(f"Could not read SVG {svg_path}")
+    image = QImage(size[0], size[1], QImage.Format_RGB888)
+    image.fill(Qt.white)
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.Antialiasing, antialias)
+    painter.setRenderHint(QPainter.SmoothPixmapTransform, antialias)
+    renderer.render(painter)
+    painter.end()
+
+    # QImage rows may be padded to 4 bytes, so go through bytesPerLine
+    buffer = np.frombuffer(image.constBits().asstring(image.sizeInBytes()), dtype=np.uint8)
+    arr = buffer.reshape(size[1], image.bytesPerLine())[:, :size[0] * 3].reshape(size[1], size[0], 3).copy()
+    if not antialias:
+        # Snap to black/white on the grey value, same as a threshold of 128
+        on = arr.mean(axis=2) >= 128
+        arr[:] = np.where(on, np.uint8(255), np.uint8(0))[..., None]
+    return arr
+
+
+def render_vector(svg_path, size, antialias=False):
+    """Like render_svg, but filled by rasterizer.py. None if the SVG has something it can't draw."""
+    try:
+        shapes = rasterizer.load_svg(svg_path, size, strict=True)
+    except (ValueError, ParseError) as e:
+        print(f"Rendering {svg_path} with Qt: {e}")
+        return None
+    if antialias:
+        plane = 255 - rasterizer.rasterize(shapes, 0, 0, size[0], size[1], VECTOR_ANTIALIAS)
+    else:
+        plane = rasterizer.rasterize(shapes, 0, 0, size[0], size[1]).to_array(on=0, off=255)
+    # The rasterizer marks the shapes as on, the SVG draws them dark on white
+    return np.repeat(plane[..., None], 3, axis=2)
+
+
+def rasterize_svg(svg_path, size, antialias=None):
+    """Rendered SVG as an RGB uint8 array, from the disk cache if it was rendered at this size before"""
+    global renders, qt_renders, disk_hits
+    if antialias is None:
+        antialias = config.SVG_ANTIALIAS
+    size = tuple(size)
+    path = cache_path(svg_path, size, antialias)
+    if os.path.exists(path):
+        try:
+            arr = np.asarray(Image.open(path).convert("RGB"))
+            if arr.shape == (size[1], size[0], 3):
+                disk_hits += 1
+                return arr
+        except Exception as e:
+            print(f"Ignoring unreadable SVG cache file {path}: {e}")
+
+    arr = render_vector(svg_path, size, antialias)
+    if arr is None:
+        arr = render_svg(svg_path, size, antialias)
+        qt_renders += 1
+    renders += 1
+    try:
+        os.makedirs(config.SVG_CACHE_FOLDER, exist_ok=True)
+        # Black/white renders are saved as 1-bit PNGs (much smaller, loads back the same)
+        mask = pack_if_binary(arr)
+        img = mask.to_image() if mask is not None else Image.fromarray(arr, "RGB")
+        temp_path = path + ".tmp"
+        img.save(temp_path, format="PNG")
+        os.replace(temp_path, path)
+    except Exception as e:
+        print(f"Could not cache SVG render {path}: {e}")
+    return arr
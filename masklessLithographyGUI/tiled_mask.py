@@ -0,0 +1,164 @@
+# Tiled access to masks that are bigger than one DLP field.
+#
+# add_images squashes a whole PNG down to LITHO_SIZE_PX_X x LITHO_SIZE_PX_Y. For a design that
+# should be exposed at native resolution, field by field, the design is instead pre-converted
+# to a raster file on disk and memory-mapped. TiledMaskSource then cuts DLP-sized tiles out
+# of it on demand, so only the rows of the current tile are ever in memory.
+#
+# Supported files:
+#   .npy  - 2D uint8 array (0 = dark, anything >= 128 = UV), e.g. from np.save()
+#   .bits - raw bit plane: BITPLANE_MAGIC, uint32 width, uint32 height (little endian),
+#           then one np.packbits row per image row (8 pixels per byte, MSB first).
+#           Written by write_bitplane(), 1 bit per pixel on disk as well as in memory.
+#
+# Nothing in the GUI loads masks through this yet, bench_tiled_mask.py is its only user. Exposing
+# a design tile by tile (one tile per site of a step and repeat job) still has to be wired up.
+
+import mmap
+import struct
+import numpy as np
+import config
+from bitmask import BitMask
+
+BITPLANE_MAGIC = b"EGENBITS"
+BITPLANE_HEADER = struct.Struct("<8sII")
+
+# The OS maps in a few neighbouring pages on every page fault (fault-around/readahead),
+# including some just before the rows we read. Released ranges start this far back to catch those.
+RELEASE_MARGIN = 1 << 20  # bytes
+
+
+def write_bitplane(path, width, height, strips):
+    """Write a .bits file from an iterable of row strips, without holding the whole design.
+
+    Each strip is either a (rows, width) array (>= 128 / True is on) or an already packed
+    (rows, ceil(width / 8)) uint8 array. The strips must add up to `height` rows.
+    """
+    row_bytes = (width + 7) // 8
+    written = 0
+    with open(path, "wb") as f:
+        f.write(BITPLANE_HEADER.pack(BITPLANE_MAGIC, width, height))
+        for strip in strips:
+            if strip.shape[1] == width:
+                packed = BitMask.from_array(strip).packed
+            elif strip.shape[1] == row_bytes and strip.dtype == np.uint8:
+                packed = strip
+            else:
+                raise ValueError(f"Strip of shape {strip.shape} doesn't match a width of {width} px")
+            f.write(np.ascontiguousarray(packed).tobytes())
+            written += packed.shape[0]
+    if written != height:
+        raise ValueError(f"Wrote {written} rows, expected {height}")
+
+
+def png_to_bitplane(png_path, bits_path, threshold=128):
+    """Convert a black/white image to a .bits file (the image itself is decoded in one go by PIL)"""
+    from PIL import Image
+    mask = BitMask.from_image(Image.open(png_path), threshold)
+    write_bitplane(bits_path, mask.width, mask.height, [mask.packed])
+
+
+class TiledMaskSource:
+    """Cuts fixed-size tiles (with optional overlap) out of a memory-mapped mask file"""
+
+    def __init__(self, path, tile_size=None, overlap=0):
+        # tile_size is (width, height), one DLP field by default.
+        # overlap is the number of pixels shared by neighbouring tiles (for stitching margins).
+        self.path = path
+        self.tile_width, self.tile_height = tile_size if tile_size is not None else (config.LITHO_SIZE_PX_X, config.LITHO_SIZE_PX_Y)
+        if not 0 <= overlap < min(self.tile_width, self.tile_height):
+            raise ValueError(f"Overlap of {overlap} px doesn't fit a {self.tile_width} x {self.tile_height} tile")
+        self.overlap = overlap
+
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if path.lower().endswith(".npy"):
+            self.packed = False
+            self._rows, self._offset = self._open_npy()
+            self.height, self.width = self._rows.shape
+        else:
+            self.packed = True
+            magic, self.width, self.height = BITPLANE_HEADER.unpack_from(self._map, 0)
+            if magic != BITPLANE_MAGIC:
+                raise ValueError(f"{path} is not a bit plane file")
+            self._offset = BITPLANE_HEADER.size
+            self._rows = np.frombuffer(self._map, dtype=np.uint8, count=self.height * ((self.width + 7) // 8),
+                                       offset=self._offset).reshape(self.height, (self.width + 7) // 8)
+
+        step_x = self.tile_width - overlap
+        step_y = self.tile_height - overlap
+        self.columns = max(1, -(-(self.width - overlap) // step_x))
+        self.rows = max(1, -(-(self.height - overlap) // step_y))
+
+    def _open_npy(self):
+        # Parse the .npy header ourselves so the data can live on our own mmap (see _release)
+        from numpy.lib import format as npy_format
+        self._file.seek(0)
+        version = npy_format.read_magic(self._file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = npy_format.read_array_header_1_0(self._file)
+        else:
+            shape, fortran_order, dtype = npy_format.read_array_header_2_0(self._file)
+        if len(shape) != 2 or dtype != np.uint8 or fortran_order:
+            raise ValueError(f"{self.path}: expected a 2D C-ordered uint8 array, got {dtype} {shape}")
+        offset = self._file.tell()
+        rows = np.frombuffer(self._map, dtype=np.uint8, count=shape[0] * shape[1], offset=offset).reshape(shape)
+        return rows, offset
+
+    def tile_origin(self, column, row):
+        """Top-left design pixel of a tile"""
+        return (column * (self.tile_width - self.overlap), row * (self.tile_height - self.overlap))
+
+    def tile(self, column, row):
+        """One tile as a BitMask (tile_height x tile_width). Past the design edge is dark."""
+        x0, y0 = self.tile_origin(column, row)
+        x1 = min(x0 + self.tile_width, self.width)
+        y1 = min(y0 + self.tile_height, self.height)
+        bits = np.zeros((self.tile_height, self.tile_width), dtype=bool)
+        if x0 < x1 and y0 < y1:
+            if self.packed:
+                # Unpack just the bytes covering [x0, x1) and cut out the exact pixels
+                first_byte = x0 // 8
+                chunk = self._rows[y0:y1, first_byte:(x1 + 7) // 8]
+                pixels = np.unpackbits(chunk, axis=1)
+                shift = x0 - first_byte * 8
+                bits[:y1 - y0, :x1 - x0] = pixels[:, shift:shift + x1 - x0]
+            else:
+                bits[:y1 - y0, :x1 - x0] = self._rows[y0:y1, x0:x1] >= 128
+            self._release(y0, y1)
+        return BitMask.from_array(bits)
+
+    def tile_into(self, column, row, out, on=255, off=0):
+        """Expand a tile straight into a 2D output plane, e.g. frame[..., 2]"""
+        return self.tile(column, row).expand_into(out, on, off)
+
+    def __iter__(self):
+        """Yields (column, row, BitMask) for every tile, row by row"""
+        for row in range(self.rows):
+            for column in range(self.columns):
+                yield column, row, self.tile(column, row)
+
+    def __len__(self):
+        return self.rows * self.columns
+
+    def _release(self, y0, y1):
+        # Tell the OS we're done with these rows, so mapped pages don't pile up in our
+        # resident memory as we walk over a big design. They stay in the page cache.
+        if not hasattr(mmap, "MADV_DONTNEED"):
+            return  # e.g. Windows; the OS trims the working set itself
+        row_bytes = self._rows.strides[0]
+        start = max(0, self._offset + y0 * row_bytes - RELEASE_MARGIN)
+        start -= start % mmap.PAGESIZE
+        end = self._offset + y1 * row_bytes
+        self._map.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+    def close(self):
+        self._rows = None
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
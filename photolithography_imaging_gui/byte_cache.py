@@ -0,0 +1,80 @@
+# Least-recently-used cache with a memory budget in bytes (instead of an entry count).
+#
+# Used by image_processing to keep decoded and resized image layers in memory,
+# so moving a brightness slider doesn't re-open and re-resize the PNGs every time.
+# Once the budget is exceeded, the entries that were used the longest time ago are dropped.
+
+import threading
+from collections import OrderedDict
+
+
+class ByteLRUCache:
+    """LRU cache that evicts old entries once the total size goes over max_bytes"""
+
+    def __init__(self, max_bytes, sizeof=None):
+        self.max_bytes = max_bytes
+        # By default, values are numpy arrays and their size is simply nbytes
+        self.sizeof = sizeof if sizeof is not None else (lambda value: value.nbytes)
+        self.current_bytes = 0
+
+        # Counters, so we can see the cache is actually doing something
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()  # key -> (value, size in bytes), oldest first
+        self._lock = threading.Lock()  # Preview compositing may run off the GUI thread
+
+    def get(self, key, default=None):
+        """Return the cached value for key (and mark it as recently used), or default"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """Store value under key, evicting the least recently used entries if needed"""
+        size = self.sizeof(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            if size > self.max_bytes:
+                return  # Would never fit; don't flush everything else for it
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self.current_bytes -= old_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """Snapshot of the cache counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
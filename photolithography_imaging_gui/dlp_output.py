@@ -0,0 +1,170 @@
+# The two things the DLP window ever shows - total darkness and the exposure pattern - built once.
+#
+# LithoWindow used to build a new QGraphicsScene + QGraphicsView for every blackout, and a new
+# QGraphicsView for every exposure. Creating, laying out and showing a widget takes several ms
+# (and varies), which ends up directly in the UV dose. DLPSurfaces is a QStackedWidget holding
+# both surfaces permanently; switching is a setCurrentIndex() and a single paint:
+#   - blackout: fills black, nothing else
+#   - exposure: blits the prepared frame centred on black
+#
+# Both are FrameBlitters: no scene, no view transform, no scrollbars. The frame is a QPixmap made
+# once in set_frame() (the blitter's own copy, so cached pixmaps aren't touched) and drawn 1:1
+# at whole device pixel coordinates, so a mask pixel is always exactly one DLP mirror (even on a
+# display with a scale factor, where Qt would otherwise scale it).
+#
+# Switch latency (switch call -> the new surface finished painting) is recorded for every switch,
+# see switch_stats().
+#
+# While something else is driving the exposure page frame by frame (a frame sequence, a step and
+# repeat job), hold() keeps set_frame() - i.e. the preview - off the DLP. The newest frame it was
+# given is put up by release().
+
+import time
+from collections import deque
+from PyQt5.QtCore import Qt, QPointF
+from PyQt5.QtGui import QImage, QPainter, QPixmap
+from PyQt5.QtWidgets import QStackedWidget, QWidget
+import image_processing
+
+
+class FrameBlitter(QWidget):
+    """Paints one prepared frame 1:1 in device pixels, centred on black"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pixmap = None
+        self.on_paint = None  # Called after every paint
+        self.setAttribute(Qt.WA_OpaquePaintEvent) # Every pixel is painted, Qt needn't clear first
+
+    def set_frame(self, frame, update=True):
+        """The frame to show: an RGB numpy frame, QImage or QPixmap (None for black only).
+
+        With update=False the caller repaints itself (frame_sequence does, to time the paint).
+        """
+        self.pixmap = None if frame is None else self.prepare(frame)
+        if update and self.isVisible():
+            self.update()
+
+    def prepare(self, frame):
+        """The blitter's own QPixmap of a frame, marked as device pixels for this widget's screen.
+
+        A QPixmap passed in is shared (frame cache, preview), so its device pixel ratio is set on
+        a copy; the pixels are only copied if the ratio differs. Preparing frames ahead (as
+        frame_sequence does) keeps that copy out of set_frame().
+        """
+        if isinstance(frame, QPixmap):
+            pixmap = QPixmap(frame)  # Shares the pixels until setDevicePixelRatio() detaches it
+        elif isinstance(frame, QImage):
+            pixmap = QPixmap.fromImage(frame)
+        else:
+            pixmap = image_processing.frame_to_pixmap(frame)
+        # Tell Qt the pixmap is already in device pixels, so it isn't scaled by the display's scale factor
+        ratio = self.devicePixelRatioF()
+        if pixmap.devicePixelRatio() != ratio:
+            pixmap.setDevicePixelRatio(ratio)
+        return pixmap
+
+    def _match_ratio(self):
+        # The window may have moved to a screen with another scale factor
+        if self.pixmap is not None and self.pixmap.devicePixelRatio() != self.devicePixelRatioF():
+            self.pixmap = self.prepare(self.pixmap)
+
+    def showEvent(self, event):
+        self._match_ratio()
+        super().showEvent(event)
+
+    def resizeEvent(self, event):
+        self._match_ratio()
+        super().resizeEvent(event)
+
+    def frame_rect(self):
+        """Where the frame lands, in device pixels (x, y, width, height), or None without a frame"""
+        if self.pixmap is None or self.pixmap.isNull():
+            return None
+        ratio = self.devicePixelRatioF()
+        width, height = round(self.width() * ratio), round(self.height() * ratio)
+        x = (width - self.pixmap.width()) // 2
+        y = (height - self.pixmap.height()) // 2
+        return (x, y, self.pixmap.width(), self.pixmap.height())
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(event.rect(), Qt.black)
+        target = self.frame_rect()
+        if target is not None:
+            ratio = self.devicePixelRatioF()
+            painter.drawPixmap(QPointF(target[0] / ratio, target[1] / ratio), self.pixmap)
+        painter.end()
+        if self.on_paint is not None:
+            self.on_paint(self)
+
+class DLPSurfaces(QStackedWidget):
+    """Blackout and exposure surfaces, switched in one paint"""
+
+    BLACKOUT = 0
+    EXPOSURE = 1
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.blackout_page = FrameBlitter()
+        self.exposure_page = FrameBlitter()
+        for page in (self.blackout_page, self.exposure_page):
+            page.on_paint = self._page_painted
+            self.addWidget(page)
+        self.setCurrentIndex(self.BLACKOUT)
+
+        self.switch_times = deque(maxlen=1000)  # Seconds per switch, most recent last
+        self._switched_at = None
+        self._held = False
+        self._held_frame = None  # Newest frame passed to set_frame() while held
+
+    def set_frame(self, frame, update=True):
+        """Replace the exposure frame; shows straight away if exposing (or is kept for release() while held)"""
+        if self._held:
+            self._held_frame = frame
+            return
+        self.exposure_page.set_frame(frame, update)
+
+    def hold(self):
+        """Stop set_frame() from reaching the DLP; the holder draws with exposure_page.set_frame() itself"""
+        if not self._held:
+            self._held = True
+            self._held_frame = self.exposure_page.pixmap
+
+    def release(self, update=True):
+        """Undo hold(): the exposure page gets the newest frame set in the meantime (or the one from before)"""
+        if self._held:
+            self._held = False
+            frame, self._held_frame = self._held_frame, None
+            self.exposure_page.set_frame(frame, update)
+
+    def held(self):
+        return self._held
+
+    def show_blackout(self):
+        """Switch to black; returns the page, which paints on the next event loop pass or repaint()"""
+        return self._switch(self.BLACKOUT)
+
+    def show_exposure(self):
+        return self._switch(self.EXPOSURE)
+
+    def exposing(self):
+        return self.currentIndex() == self.EXPOSURE
+
+    def _switch(self, index):
+        if index != self.currentIndex():
+            self._switched_at = time.perf_counter()
+            self.setCurrentIndex(index)
+        return self.currentWidget()
+
+    def _page_painted(self, page):
+        if self._switched_at is not None and page is self.currentWidget():
+            self.switch_times.append(time.perf_counter() - self._switched_at)
+            self._switched_at = None
+
+    def switch_stats(self):
+        """(count, mean ms, worst ms) of the recorded switches"""
+        if not self.switch_times:
+            return (0, None, None)
+        times = list(self.switch_times)
+        return (len(times), sum(times) / len(times) * 1000, max(times) * 1000)
@@ -0,0 +1,143 @@
+# Timed UV exposures with millisecond accuracy, and a log of how long the pattern was really up.
+#
+# A plain QTimer can fire several ms late (it's an event on a busy GUI thread, and the OS timer
+# resolution is coarse on Windows), so the exposure timer wakes up SPIN_MARGIN early and busy-waits
+# the rest on time.perf_counter().
+#
+# The pattern only exposes the wafer once it is actually on screen, so both ends are timestamped
+# when the DLP window paints: the new widget is repainted right away (QWidget.repaint() paints
+# and flushes to the window before returning), and an event filter checks that a paint really
+# happened (a hidden window never paints, e.g. with no DLP connected). The exposure clock
+# starts at the "on" paint, and the measured on-time is "off" paint minus "on" paint.
+# Switching to the blackout takes a few ms itself, so the timer learns that latency
+# (off_latency, a running average) and starts the blackout that much early.
+#
+# Every exposure is appended to config.EXPOSURE_LOG (CSV) with its target, measured time and error.
+
+import csv
+import os
+import time
+from datetime import datetime
+from PyQt5.QtCore import QObject, QEvent, QTimer, Qt, pyqtSignal
+import config
+
+SPIN_MARGIN = 0.02  # seconds before the end of an exposure that the QTimer wakes up
+LATENCY_SMOOTHING = 0.2  # Weight of the newest blackout latency in the running average
+LOG_FIELDS = ["started", "target_s", "measured_s", "error_ms", "commanded_s", "aborted"]
+
+
+class PaintClock(QObject):
+    """Repaints a widget immediately and returns when that happened (None if it didn't paint)"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._painted = False
+
+    def paint_now(self, widget):
+        if widget.window().isVisible() and not widget.isVisible():
+            widget.show() # Not shown yet, Qt would only show it on the next event loop pass
+        self._painted = False
+        widget.installEventFilter(self)
+        try:
+            widget.repaint()
+        finally:
+            widget.removeEventFilter(self)
+        return time.perf_counter() if self._painted else None
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint:
+            self._painted = True
+        return False
+
+
+class ExposureTimer(QObject):
+    """Shows the pattern, blacks it out after exactly `duration` seconds, and reports the real on-time"""
+
+    finished = pyqtSignal(dict)  # One LOG_FIELDS record per exposure
+
+    def __init__(self, parent=None, log_path=None):
+        super().__init__(parent)
+        self.log_path = config.EXPOSURE_LOG if log_path is None else log_path
+        self.history = []  # Records of this session
+        self.clock = PaintClock(self)
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self._wake)
+        self.off_latency = 0.0  # Seconds from hide() to the blackout being painted
+        self._hide = None
+        self._record = None
+
+    def active(self):
+        return self._record is not None
+
+    def start(self, duration, show, hide):
+        """show() puts the pattern up and returns the widget showing it; hide() does the same for the blackout"""
+        if self.active():
+            self.cancel()
+        self._hide = hide
+        commanded = time.perf_counter()
+        shown_at = self.clock.paint_now(show())
+        start = shown_at if shown_at is not None else commanded
+        self._record = {"started": datetime.now().isoformat(timespec="milliseconds"), "target_s": duration,
+                        "_commanded": commanded, "_shown_at": shown_at,
+                        "_deadline": start + max(0.0, duration - self.off_latency)}
+        self.timer.start(max(0, int((self._record["_deadline"] - time.perf_counter() - SPIN_MARGIN) * 1000)))
+
+    def cancel(self):
+        """Black out now (STOP button); the exposure is logged as aborted"""
+        if self.active():
+            self.timer.stop()
+            self._finish(aborted=True)
+
+    def _wake(self):
+        # Busy-wait the last few ms; the GUI is only held for SPIN_MARGIN at most
+        deadline = self._record["_deadline"]
+        while time.perf_counter() < deadline:
+            pass
+        self._finish(aborted=False)
+
+    def _finish(self, aborted):
+        record, self._record = self._record, None
+        commanded_off = time.perf_counter()
+        hidden_at = self.clock.paint_now(self._hide())
+        if hidden_at is not None:
+            latency = hidden_at - commanded_off
+            self.off_latency += LATENCY_SMOOTHING * (latency - self.off_latency)
+        measured = hidden_at - record["_shown_at"] if hidden_at is not None and record["_shown_at"] is not None else None
+        result = {
+            "started": record["started"],
+            "target_s": record["target_s"],
+            "measured_s": measured,
+            "error_ms": (measured - record["target_s"]) * 1000 if measured is not None else None,
+            "commanded_s": commanded_off - record["_commanded"],
+            "aborted": aborted,
+        }
+        self.history.append(result)
+        self._log(result)
+        self.finished.emit(result)
+
+    def _log(self, result):
+        if result["measured_s"] is None:
+            print(f"Exposure of {result['target_s']:.3f} s ended (not displayed, commanded {result['commanded_s']:.4f} s)")
+        else:
+            print(f"Exposure of {result['target_s']:.3f} s {'aborted' if result['aborted'] else 'done'}: "
+                  f"on for {result['measured_s']:.4f} s ({result['error_ms']:+.2f} ms)")
+        if not self.log_path:
+            return
+        try:
+            new_file = not os.path.exists(self.log_path)
+            with open(self.log_path, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=LOG_FIELDS)
+                if new_file:
+                    writer.writeheader()
+                writer.writerow(result)
+        except Exception as e:
+            print(f"Could not write exposure log {self.log_path}: {e}")
+
+    def error_stats(self):
+        """(count, mean, worst absolute) error in ms over this session's completed, displayed exposures"""
+        errors = [r["error_ms"] for r in self.history if r["error_ms"] is not None and not r["aborted"]]
+        if not errors:
+            return (0, None, None)
+        return (len(errors), sum(errors) / len(errors), max(abs(e) for e in errors))